@@ -1,20 +1,30 @@
-from flask import Flask, render_template, request, jsonify, send_file
+from flask import Flask, render_template, request, jsonify, send_file, Response
 from flask_migrate import Migrate
 from flask_cors import CORS
 from datetime import datetime
 import os
 import json
 from werkzeug.utils import secure_filename
+from sqlalchemy.orm import selectinload
 import hashlib
+import uuid
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-change-in-production'
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///database.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///database.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['UPLOAD_FOLDER'] = 'music'
 app.config['MAX_CONTENT_LENGTH'] = 100 * 1024 * 1024  # 100MB max file size
 
-from models import db, MusicFile, Evaluation
+from models import db, MusicFile, Evaluation, Sweep, SweepRun
+from config import SWEEP_CONFIG, INFERENCE_CONFIG, EVENTS_CONFIG
+from stats import rating_stats
+from search import init_search_index, search_prompts, add_prompt_embedding, prompt_index, similar_music
+from sweep import plan_sweep, sweep_report, list_sweeps
+from audio_buffers import AudioBuffer, audio_buffers, transfer_stats
+from inference import inference_pool
+from events import (event_broker, running_totals, music_deltas, library_totals, publish_music_created,
+                    publish_evaluation_created, publish_generation_progress)
 
 db.init_app(app)
 migrate = Migrate(app, db)
@@ -45,21 +55,30 @@ def evaluate_page():
 @app.route('/api/music/list')
 def list_music():
     """List all music files in the database."""
-    music_files = MusicFile.query.order_by(MusicFile.created_at.desc()).all()
-    return jsonify([{
-        'id': m.id,
-        'filename': m.filename,
-        'prompt': m.prompt,
-        'created_at': m.created_at.isoformat(),
-        'evaluated': m.is_evaluated(),
-        'average_rating': m.get_average_rating()
-    } for m in music_files])
+    return jsonify(music_deltas())
+
+@app.route('/api/events')
+def stream_events():
+    """
+    Server-sent events stream of library changes, or with ?job_id= of the
+    progress of one generation job.
+    """
+    response = Response(
+        event_broker.stream(request.headers.get('Last-Event-ID'), heartbeat=EVENTS_CONFIG['HEARTBEAT_SECONDS'],
+                            job_id=request.args.get('job_id') or None),
+        mimetype='text/event-stream',
+        direct_passthrough=True
+    )
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/api/music/scan')
 def scan_music_folder():
     """Scan music folder and add new files to database."""
     music_dir = app.config['UPLOAD_FOLDER']
     added_files = []
+    added_music = []
     
     for filename in os.listdir(music_dir):
         if filename.lower().endswith(('.wav', '.mp3', '.flac', '.m4a')):
@@ -76,8 +95,10 @@ def scan_music_folder():
                 )
                 db.session.add(music_file)
                 added_files.append(filename)
+                added_music.append(music_file)
     
     db.session.commit()
+    publish_music_created(added_music)
     return jsonify({
         'message': f'Added {len(added_files)} new files',
         'files': added_files
@@ -86,9 +107,34 @@ def scan_music_folder():
 @app.route('/api/music/<int:music_id>/stream')
 def stream_music(music_id):
     """Stream a music file."""
+    cached = audio_buffers.get(music_id)
+    if cached:
+        return stream_audio_buffer(*cached)
+    
     music_file = MusicFile.query.get_or_404(music_id)
+    transfer_stats.record(music_file.filename, 'serve_from_disk', os.path.getsize(music_file.filepath))
     return send_file(music_file.filepath, mimetype='audio/wav')
 
+def stream_audio_buffer(buffer, clip):
+    """Serve a clip straight from its shared-memory buffer, honouring Range requests."""
+    start, stop, status = 0, buffer.size, 200
+    if request.range:
+        byte_range = request.range.range_for_length(buffer.size)
+        if byte_range:
+            (start, stop), status = byte_range, 206
+    
+    response = Response(
+        buffer.stream(start, stop, on_close=lambda sent: transfer_stats.record(clip, 'serve_from_shared_memory', sent)),
+        status=status,
+        mimetype='audio/wav',
+        direct_passthrough=True
+    )
+    response.content_length = stop - start
+    response.headers['Accept-Ranges'] = 'bytes'
+    if status == 206:
+        response.headers['Content-Range'] = f'bytes {start}-{stop - 1}/{buffer.size}'
+    return response
+
 @app.route('/api/generate', methods=['POST'])
 def generate_music():
     """Generate music using MusicGen."""
@@ -98,25 +144,41 @@ def generate_music():
     temperature = data.get('temperature', 1.0)
     model_size = data.get('model', 'small')
     guidance_scale = data.get('guidance_scale', 3.0)
-    
-    # Import MusicGen API
-    from musicgen_api import generate_music_with_musicgen
+    job_id = data.get('job_id') or uuid.uuid4().hex
+    handoff = INFERENCE_CONFIG['AUDIO_HANDOFF']
+    buffer = None
     
     try:
-        # Call actual MusicGen generation
-        result = generate_music_with_musicgen(
+        publish_generation_progress(job_id, 'started', prompt=prompt)
+        
+        # Call actual MusicGen generation, in a worker process if configured
+        result = inference_pool.generate(
             prompt=prompt,
             duration=duration,
             temperature=temperature,
             guidance_scale=guidance_scale,
-            model_size=model_size
+            model_size=model_size,
+            output='shared_memory' if handoff == 'shared_memory' else 'file',
+            progress=lambda step, total: publish_generation_progress(job_id, 'decoding', step=step, total=total)
         )
+        publish_generation_progress(job_id, 'saving')
+        clip = result['filename']
+        transfer_stats.merge(clip, result['transfers'], handoff)
+        
+        # Hash the audio in place from shared memory, or re-read it from disk
+        if result.get('shared_memory'):
+            buffer = AudioBuffer.attach(result['shared_memory'])
+            file_hash = buffer.md5()
+            transfer_stats.record(clip, 'hash_in_place', buffer.size, copied=False)
+        else:
+            file_hash = get_file_hash(result['filepath'])
+            transfer_stats.record(clip, 'hash_file_read', os.path.getsize(result['filepath']))
         
         # Save generated file info to database
         music_file = MusicFile(
             filename=result['filename'],
             filepath=result['filepath'],
-            file_hash=get_file_hash(result['filepath']),
+            file_hash=file_hash,
             prompt=prompt,
             generation_params=json.dumps({
                 'duration': duration,
@@ -126,20 +188,184 @@ def generate_music():
             })
         )
         db.session.add(music_file)
+        db.session.flush()
+        if result.get('prompt_embedding') is not None:
+            add_prompt_embedding(music_file.id, result['prompt_embedding'])
         db.session.commit()
         
+        # Keep serving from memory while the file is written in the background
+        if buffer is not None:
+            audio_buffers.register(music_file.id, buffer, result['filepath'], clip=clip)
+        
+        publish_music_created([music_file])
+        publish_generation_progress(job_id, 'done', music_id=music_file.id)
+        
         return jsonify({
             'success': True,
+            'job_id': job_id,
             'music_id': music_file.id,
             'message': 'Music generated successfully',
             'filename': result['filename']
         })
     except Exception as e:
+        db.session.rollback()
+        if buffer is not None:
+            buffer.release()
+        publish_generation_progress(job_id, 'failed', message=str(e))
         return jsonify({
             'success': False,
             'message': f'Generation failed: {str(e)}'
         }), 500
 
+@app.route('/api/sweeps/plan', methods=['POST'])
+def plan_sweep_jobs():
+    """Expand a sweep spec into its job set without generating anything."""
+    try:
+        plan = plan_sweep(request.json or {})
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify({
+        'unique_prompts': len(plan['prompts']),
+        'jobs': len(plan['jobs']),
+        'prompts': plan['prompts'],
+        'skipped': plan['skipped']
+    })
+
+@app.route('/api/sweeps', methods=['POST'])
+def run_sweep():
+    """Generate every job of a prompt-template sweep as batched MusicGen runs."""
+    data = request.json or {}
+    model_size = data.get('model', 'small')
+    batch_size = data.get('batch_size', SWEEP_CONFIG['BATCH_SIZE'])
+    if isinstance(batch_size, bool) or not isinstance(batch_size, int) or batch_size < 1:
+        return jsonify({'success': False, 'message': 'batch_size must be a positive integer'}), 400
+    
+    try:
+        plan = plan_sweep(data)
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    
+    job_id = data.get('job_id') or uuid.uuid4().hex
+    try:
+        publish_generation_progress(job_id, 'started', clips=len(plan['jobs']))
+        # Batched MusicGen runs, in a worker process if configured
+        results = inference_pool.generate_batch(
+            prompts=plan['prompts'],
+            runs=plan['jobs'],
+            model_size=model_size,
+            batch_size=batch_size,
+            progress=lambda done, total: publish_generation_progress(job_id, 'decoding', step=done, total=total)
+        )
+        publish_generation_progress(job_id, 'saving')
+        
+        sweep = Sweep(
+            name=data.get('name'),
+            spec=json.dumps({k: data.get(k) for k in ('templates', 'categories', 'values', 'grid')}),
+            model_size=model_size
+        )
+        db.session.add(sweep)
+        db.session.flush()
+        
+        added_music = []
+        for job, result in zip(plan['jobs'], results):
+            coordinates = job['coordinates']
+            file_hash = get_file_hash(result['filepath'])
+            
+            # Grid points can produce identical audio; link those runs to the existing file
+            music_file = MusicFile.query.filter_by(file_hash=file_hash).first()
+            if music_file:
+                os.remove(result['filepath'])
+            else:
+                music_file = MusicFile(
+                    filename=result['filename'],
+                    filepath=result['filepath'],
+                    file_hash=file_hash,
+                    prompt=job['prompt'],
+                    generation_params=json.dumps({
+                        **job['params'],
+                        'model_size': model_size,
+                        'category': coordinates[0]['category'],
+                        'sweep_id': sweep.id
+                    })
+                )
+                db.session.add(music_file)
+                db.session.flush()
+                add_prompt_embedding(music_file.id, result['prompt_embedding'])
+                added_music.append(music_file)
+            db.session.add(SweepRun(
+                sweep_id=sweep.id,
+                music_id=music_file.id,
+                coordinates=json.dumps({'params': job['params'], 'templates': coordinates})
+            ))
+        db.session.commit()
+        
+        publish_music_created(added_music)
+        publish_generation_progress(job_id, 'done', sweep_id=sweep.id)
+        
+        return jsonify({
+            'success': True,
+            'job_id': job_id,
+            'sweep_id': sweep.id,
+            'message': f'Generated {len(results)} clips from {len(plan["prompts"])} unique prompts',
+            'report': sweep_report(sweep)
+        })
+    except Exception as e:
+        db.session.rollback()
+        publish_generation_progress(job_id, 'failed', message=str(e))
+        return jsonify({
+            'success': False,
+            'message': f'Sweep failed: {str(e)}'
+        }), 500
+
+@app.route('/api/sweeps')
+def get_sweeps():
+    """List all sweeps."""
+    return jsonify(list_sweeps())
+
+@app.route('/api/sweeps/<int:sweep_id>')
+def get_sweep_report(sweep_id):
+    """Report linking each generated file of a sweep to its grid coordinates."""
+    sweep = Sweep.query.get_or_404(sweep_id)
+    return jsonify(sweep_report(sweep))
+
+@app.route('/api/metrics/audio')
+def audio_transfer_metrics():
+    """Per-clip copy counts and bytes moved, for each audio handoff mode."""
+    return jsonify(transfer_stats.summary())
+
+@app.route('/api/search')
+def search_music():
+    """Full-text search over prompts and generation parameters."""
+    query = request.args.get('q', '')
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify(search_prompts(query, limit=limit))
+
+@app.route('/api/search/similar')
+def search_similar_music():
+    """Nearest-neighbour lookup over prompt embeddings, by music file or by text."""
+    limit = request.args.get('limit', 10, type=int)
+    music_id = request.args.get('music_id', type=int)
+    
+    if music_id is not None:
+        vector = prompt_index.vector_for(music_id)
+        if vector is None:
+            return jsonify({'success': False, 'message': 'No prompt embedding for this music file'}), 404
+        return jsonify(similar_music(vector, limit=limit, exclude=music_id))
+    
+    query = request.args.get('q', '')
+    if not query:
+        return jsonify({'success': False, 'message': 'Provide music_id or q'}), 400
+    
+    # Embedding free text needs the MusicGen text encoder, in a worker process if configured
+    try:
+        vector = inference_pool.embed_prompts([query], model_size=request.args.get('model', 'small'))[0]
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': f'Embedding failed: {str(e)}'
+        }), 500
+    return jsonify(similar_music(vector, limit=limit))
+
 @app.route('/api/evaluate', methods=['POST'])
 def evaluate_music():
     """Submit an evaluation for a music file."""
@@ -167,6 +393,7 @@ def evaluate_music():
     
     db.session.add(evaluation)
     db.session.commit()
+    publish_evaluation_created(evaluation)
     
     return jsonify({
         'success': True,
@@ -199,8 +426,8 @@ def get_evaluations(music_id):
 @app.route('/api/export/evaluations')
 def export_evaluations():
     """Export all evaluations as JSON."""
-    evaluations = Evaluation.query.all()
-    music_files = MusicFile.query.all()
+    # Load every file's evaluations in one extra query rather than one per file
+    music_files = MusicFile.query.options(selectinload(MusicFile.evaluations)).all()
     
     export_data = {
         'export_date': datetime.now().isoformat(),
@@ -231,7 +458,58 @@ def export_evaluations():
     
     return jsonify(export_data)
 
-if __name__ == '__main__':
+def _flag(name, default=False):
+    """Read a boolean query string parameter."""
+    value = request.args.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes')
+
+@app.route('/api/stats/summary')
+def stats_summary():
+    """Library totals shown on the dashboard."""
+    return jsonify(library_totals())
+
+@app.route('/api/stats/leaderboard')
+def stats_leaderboard():
+    """Rank model sizes or prompt categories by mean rating with bootstrap CIs."""
+    try:
+        board = rating_stats.leaderboard(
+            group_by=request.args.get('group_by', 'model_size'),
+            criterion=request.args.get('criterion', 'overall_rating'),
+            corrected=_flag('corrected')
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(board)
+
+@app.route('/api/stats/reliability')
+def stats_reliability():
+    """Inter-rater reliability (Krippendorff's alpha and ICC) per criterion."""
+    return jsonify(rating_stats.reliability(corrected=_flag('corrected')))
+
+@app.route('/api/stats/scores')
+def stats_scores():
+    """Per music file mean scores, rater-bias corrected by default."""
+    try:
+        scores = rating_stats.music_scores(
+            criterion=request.args.get('criterion', 'overall_rating'),
+            corrected=_flag('corrected', default=True)
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    return jsonify(scores)
+
+def init_database():
+    """Create missing tables and the prompt search index, and warm the in-memory indexes and totals."""
     with app.app_context():
         db.create_all()
+        init_search_index()
+        # Load every rating and prompt embedding now so the first requests do not pay for it
+        rating_stats.refresh()
+        prompt_index.refresh()
+        running_totals.load()
+
+if __name__ == '__main__':
+    init_database()
     app.run(debug=True, port=8080)
\ No newline at end of file
@@ -0,0 +1,315 @@
+"""
+Audio Buffer Module
+This module hands generated audio from inference workers to the web tier
+through shared memory. Decoded audio is copied once, straight from the model
+output tensor into a shared-memory WAV image; the web tier hashes and streams
+from that buffer while a background thread persists it to disk. Every copy
+and read of clip bytes is counted so the two handoff paths can be compared.
+"""
+
+import os
+import time
+import atexit
+import struct
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from config import INFERENCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Attempts at writing a clip to disk before it is kept in memory only
+PERSIST_ATTEMPTS = 3
+
+# Matches the float32 WAV layout written by scipy.io.wavfile, so hashes agree
+# with the legacy disk path: RIFF/WAVE, 18-byte fmt chunk, fact chunk, data
+WAV_HEADER_SIZE = 58
+
+def wav_header(num_samples, sample_rate, channels=1):
+    """Build the header of an IEEE float32 WAV file."""
+    data_size = num_samples * channels * 4
+    return b''.join([
+        b'RIFF', struct.pack('<I', WAV_HEADER_SIZE - 8 + data_size), b'WAVE',
+        b'fmt ', struct.pack('<IHHIIHHH', 18, 3, channels, sample_rate,
+                             sample_rate * channels * 4, channels * 4, 32, 0),
+        b'fact', struct.pack('<II', 4, num_samples),
+        b'data', struct.pack('<I', data_size)
+    ])
+
+class TransferStats:
+    """
+    Per-clip counters of copies made and bytes moved.
+
+    A stage either copies the clip bytes into a new buffer (copied=True) or
+    only reads them in place, e.g. hashing a shared-memory view.
+    """
+
+    def __init__(self, max_clips=1000):
+        self.max_clips = max_clips
+        self._clips = OrderedDict()
+        self._lock = threading.Lock()
+
+    def record(self, clip, stage, nbytes, copied=True, handoff=None):
+        with self._lock:
+            entry = self._clips.get(clip)
+            if entry is None:
+                entry = self._clips[clip] = {'handoff': handoff, 'stages': []}
+                while len(self._clips) > self.max_clips:
+                    self._clips.popitem(last=False)
+            if handoff:
+                entry['handoff'] = handoff
+            entry['stages'].append({'stage': stage, 'bytes': int(nbytes), 'copied': copied})
+
+    def merge(self, clip, transfers, handoff=None):
+        """Record stages measured in another process (e.g. an inference worker)."""
+        for transfer in transfers:
+            self.record(clip, transfer['stage'], transfer['bytes'], transfer['copied'], handoff)
+
+    def summary(self):
+        """
+        Average copies and bytes moved per clip, for each handoff mode.
+
+        Returns:
+            dict: Handoff mode mapped to its clip count, per-clip averages and
+                  per-stage totals
+        """
+        with self._lock:
+            clips = list(self._clips.values())
+
+        modes = {}
+        for entry in clips:
+            mode = modes.setdefault(entry['handoff'] or 'unknown', {'clips': 0, 'copies': 0, 'bytes_copied': 0,
+                                                                    'bytes_read': 0, 'stages': {}})
+            mode['clips'] += 1
+            for stage in entry['stages']:
+                totals = mode['stages'].setdefault(stage['stage'], {'count': 0, 'bytes': 0, 'copied': stage['copied']})
+                totals['count'] += 1
+                totals['bytes'] += stage['bytes']
+                if stage['copied']:
+                    mode['copies'] += 1
+                    mode['bytes_copied'] += stage['bytes']
+                else:
+                    mode['bytes_read'] += stage['bytes']
+
+        return {name: {
+            'clips': mode['clips'],
+            'copies_per_clip': mode['copies'] / mode['clips'],
+            'bytes_copied_per_clip': mode['bytes_copied'] / mode['clips'],
+            'bytes_read_in_place_per_clip': mode['bytes_read'] / mode['clips'],
+            'stages': mode['stages']
+        } for name, mode in modes.items()}
+
+    def reset(self):
+        with self._lock:
+            self._clips.clear()
+
+def write_shared_audio(audio, sample_rate):
+    """
+    Copy mono float32 audio into a new shared-memory WAV image.
+
+    The samples are copied exactly once, from wherever they live (CPU or GPU)
+    directly into the shared segment. The segment is left for the receiving
+    process to attach to and eventually unlink.
+
+    Args:
+        audio (torch.Tensor or np.ndarray): 1-D float32 audio samples
+        sample_rate (int): Sampling rate in Hz
+
+    Returns:
+        tuple: (handle dict to pass to AudioBuffer.attach, list of transfers)
+    """
+    if isinstance(audio, np.ndarray):
+        audio = np.ascontiguousarray(audio, dtype=np.float32)
+        num_samples = audio.size
+    else:
+        import torch
+        audio = audio.detach().to(torch.float32).contiguous()
+        num_samples = audio.numel()
+    data_size = num_samples * 4
+    shm = shared_memory.SharedMemory(create=True, size=WAV_HEADER_SIZE + data_size)
+    try:
+        shm.buf[:WAV_HEADER_SIZE] = wav_header(num_samples, sample_rate)
+        target = np.ndarray((data_size,), dtype=np.uint8, buffer=shm.buf, offset=WAV_HEADER_SIZE)
+        if isinstance(audio, np.ndarray):
+            target[:] = audio.view(np.uint8)
+        else:
+            torch.from_numpy(target).copy_(audio.view(torch.uint8))
+        del target
+    finally:
+        shm.close()
+
+    handle = {'name': shm.name, 'size': WAV_HEADER_SIZE + data_size}
+    return handle, [{'stage': 'tensor_to_shared_memory', 'bytes': data_size, 'copied': True}]
+
+class AudioBuffer:
+    """A WAV image in shared memory, attached in the web process."""
+
+    def __init__(self, shm, size):
+        self._shm = shm
+        self.size = size
+        self.view = shm.buf[:size]
+        self.readers = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def attach(cls, handle):
+        """Attach to a segment created by `write_shared_audio`."""
+        return cls(shared_memory.SharedMemory(name=handle['name']), handle['size'])
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def md5(self):
+        """MD5 of the WAV bytes, hashed in place without copying."""
+        return hashlib.md5(self.view).hexdigest()
+
+    def stream(self, start=0, stop=None, chunk_size=64 * 1024, on_close=None):
+        """
+        Iterate over the WAV bytes `[start, stop)` in chunks for a response body.
+
+        WSGI servers require bytes, so each chunk is one copy out of shared
+        memory; there is no disk read. The buffer is pinned against eviction
+        until the server closes the iterable.
+
+        Args:
+            on_close (callable): Called with the number of bytes sent
+        """
+        return _ChunkStream(self, start, self.size if stop is None else stop, chunk_size, on_close)
+
+    def persist(self, filepath):
+        """Write the WAV bytes to disk atomically."""
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{filepath}.part"
+        with open(temporary, 'wb') as f:
+            f.write(self.view)
+        os.replace(temporary, filepath)
+
+    def release(self):
+        """Detach and free the shared-memory segment."""
+        self.view.release()
+        self._shm.close()
+        try:
+            self._shm.unlink()
+        except FileNotFoundError:
+            pass
+
+class _ChunkStream:
+    """WSGI response iterable over a slice of an AudioBuffer."""
+
+    def __init__(self, buffer, start, stop, chunk_size, on_close):
+        self._buffer = buffer
+        self._offset = start
+        self._stop = stop
+        self._chunk_size = chunk_size
+        self._on_close = on_close
+        self._sent = 0
+        self._closed = False
+        with buffer._lock:
+            buffer.readers += 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed or self._offset >= self._stop:
+            raise StopIteration
+        end = min(self._offset + self._chunk_size, self._stop)
+        chunk = bytes(self._buffer.view[self._offset:end])
+        self._offset = end
+        self._sent += len(chunk)
+        return chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        with self._buffer._lock:
+            self._buffer.readers -= 1
+        if self._on_close is not None:
+            self._on_close(self._sent)
+
+class AudioBufferRegistry:
+    """
+    Recently generated clips kept in shared memory for hashing and streaming.
+
+    Each registered clip is persisted to disk on a background thread. Once the
+    registry holds more than `capacity` clips, the oldest persisted ones are
+    released and served from disk again. A clip whose write keeps failing is
+    never released, since its buffer is the only copy of the audio.
+    """
+
+    def __init__(self, capacity=32, stats=None):
+        self.capacity = capacity
+        self.stats = stats
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='audio-persist')
+
+    def register(self, music_id, buffer, filepath, clip=None):
+        """
+        Take ownership of a buffer and schedule its persistence to `filepath`.
+
+        Returns:
+            Future: Completes when the file has been written
+        """
+        future = self._executor.submit(self._persist, buffer, filepath, clip)
+        with self._lock:
+            self._entries[music_id] = (buffer, future, clip)
+            self._evict()
+        return future
+
+    def _persist(self, buffer, filepath, clip):
+        for attempt in range(1, PERSIST_ATTEMPTS + 1):
+            try:
+                buffer.persist(filepath)
+                break
+            except Exception as e:
+                if attempt == PERSIST_ATTEMPTS:
+                    logger.error(f"Failed to write {filepath}, keeping it in shared memory: {str(e)}")
+                    raise
+                logger.warning(f"Writing {filepath} failed (attempt {attempt} of {PERSIST_ATTEMPTS}): {str(e)}")
+                time.sleep(attempt)
+        if self.stats is not None and clip is not None:
+            self.stats.record(clip, 'persist_to_disk', buffer.size, copied=True)
+
+    def get(self, music_id):
+        """Return the (buffer, clip) of a registered music file, or None."""
+        with self._lock:
+            entry = self._entries.get(music_id)
+            if entry is None:
+                return None
+            self._entries.move_to_end(music_id)
+            return entry[0], entry[2]
+
+    def _evict(self):
+        for music_id in list(self._entries):
+            if len(self._entries) <= self.capacity:
+                break
+            buffer, future, _ = self._entries[music_id]
+            if future.done() and future.exception() is None and buffer.readers == 0:
+                del self._entries[music_id]
+                buffer.release()
+
+    def close(self):
+        """Wait for pending writes, then free every buffer."""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            for music_id, (buffer, future, _) in self._entries.items():
+                if future.exception() is not None:
+                    logger.error(f"Music file {music_id} was never written to disk; its audio is lost")
+                buffer.release()
+            self._entries.clear()
+
+# Shared instances used by the web application
+transfer_stats = TransferStats()
+audio_buffers = AudioBufferRegistry(capacity=INFERENCE_CONFIG['BUFFER_CACHE_SIZE'], stats=transfer_stats)
+atexit.register(audio_buffers.close)
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Benchmark the static-cache decoding engine against stock MusicGen generate
+Usage: python benchmark_decoding.py --model small --duration 10 --seeds 3
+
+Each prompt/seed/guidance combination is generated with both engines from the
+same seed. The audio must be identical; the script exits non-zero otherwise.
+"""
+
+import argparse
+import sys
+import time
+import torch
+from musicgen_api import load_musicgen_model, encode_text_prompts, decode_audio
+from config import MUSICGEN_CONFIG
+
+DEFAULT_PROMPTS = [
+    "Baroque violin piece with complex counterpoint",
+    "Ambient calm soundscape with evolving pads",
+    "Upbeat jazz trio with walking bass and brushed drums"
+]
+
+def timed_decode(model, engine, inputs, hidden_states, args, guidance_scale, seed):
+    """Decode one batch from a fixed seed and return (audio, seconds)."""
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    torch.manual_seed(seed)
+    start = time.perf_counter()
+    audio = decode_audio(model, engine, inputs['input_ids'], hidden_states, inputs['attention_mask'],
+                         int(args.duration * 50), guidance_scale, args.temperature, args.top_k, args.top_p)
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+    return audio, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare decoding engines at matched seeds')
+    parser.add_argument('prompts', nargs='*', default=DEFAULT_PROMPTS, help='Prompts to generate')
+    parser.add_argument('--model', type=str, default=MUSICGEN_CONFIG['DEFAULT_MODEL'],
+                       choices=['small', 'medium', 'large', 'melody'])
+    parser.add_argument('--duration', type=float, default=MUSICGEN_CONFIG['DEFAULT_DURATION'],
+                       help=f'Duration in seconds (default: {MUSICGEN_CONFIG["DEFAULT_DURATION"]})')
+    parser.add_argument('--guidance', type=float, nargs='+', default=[MUSICGEN_CONFIG['DEFAULT_GUIDANCE_SCALE'], 1.0],
+                       help='Guidance scales to benchmark (default: 3.0 1.0)')
+    parser.add_argument('--seeds', type=int, default=3, help='Seeds per prompt (default: 3)')
+    parser.add_argument('--batch', action='store_true', help='Generate all prompts as one batch')
+    parser.add_argument('--temperature', type=float, default=MUSICGEN_CONFIG['DEFAULT_TEMPERATURE'])
+    parser.add_argument('--top-k', type=int, default=MUSICGEN_CONFIG['DEFAULT_TOP_K'])
+    parser.add_argument('--top-p', type=float, default=MUSICGEN_CONFIG['DEFAULT_TOP_P'])
+    args = parser.parse_args()
+
+    model, processor, device = load_musicgen_model(args.model)
+    batches = [args.prompts] if args.batch else [[prompt] for prompt in args.prompts]
+
+    # Warm up both engines so one-off allocations are not timed
+    inputs = processor(text=batches[0], padding=True, return_tensors="pt")
+    if device != "cpu":
+        inputs = inputs.to(device)
+    hidden_states = encode_text_prompts(model, inputs)
+    warmup = argparse.Namespace(**{**vars(args), 'duration': 0.5})
+    for engine in ('stock', 'static_cache'):
+        timed_decode(model, engine, inputs, hidden_states, warmup, args.guidance[0], 0)
+
+    print(f"\n{'guidance':>8}  {'batch':>5}  {'seed':>4}  {'stock':>8}  {'static':>8}  {'speedup':>7}  identical")
+    print("-" * 64)
+    mismatches = 0
+    totals = {}
+    for guidance_scale in args.guidance:
+        for prompts in batches:
+            inputs = processor(text=prompts, padding=True, return_tensors="pt")
+            if device != "cpu":
+                inputs = inputs.to(device)
+            hidden_states = encode_text_prompts(model, inputs)
+
+            for seed in range(args.seeds):
+                stock, stock_seconds = timed_decode(model, 'stock', inputs, hidden_states, args, guidance_scale, seed)
+                static, static_seconds = timed_decode(model, 'static_cache', inputs, hidden_states, args,
+                                                      guidance_scale, seed)
+                identical = torch.equal(stock, static)
+                mismatches += not identical
+                total = totals.setdefault(guidance_scale, [0.0, 0.0])
+                total[0] += stock_seconds
+                total[1] += static_seconds
+                print(f"{guidance_scale:>8}  {len(prompts):>5}  {seed:>4}  {stock_seconds:>7.2f}s  "
+                      f"{static_seconds:>7.2f}s  {stock_seconds / static_seconds:>6.2f}x  "
+                      f"{'yes' if identical else 'NO (max diff %.3g)' % (stock - static).abs().max().item()}")
+
+    print("-" * 64)
+    for guidance_scale, (stock_seconds, static_seconds) in totals.items():
+        print(f"guidance {guidance_scale}: stock {stock_seconds:.2f}s, static_cache {static_seconds:.2f}s, "
+              f"speedup {stock_seconds / static_seconds:.2f}x")
+    print(f"{mismatches} mismatched outputs on {device}\n")
+    sys.exit(1 if mismatches else 0)
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ import os
 # Application Settings
 APP_CONFIG = {
     'SECRET_KEY': os.environ.get('SECRET_KEY', 'your-secret-key-change-in-production'),
-    'DATABASE_URI': 'sqlite:///database.db',
+    'DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite:///database.db'),
     'UPLOAD_FOLDER': 'music',
     'MAX_CONTENT_LENGTH': 100 * 1024 * 1024,  # 100MB max file size
     'PORT': 8080,
@@ -35,6 +35,16 @@ MUSICGEN_CONFIG = {
     # Maximum generation limits
     'MAX_DURATION': 30,  # Maximum duration in seconds
     
+    # Decoding loop: 'static_cache' (preallocated KV cache, shared unconditional
+    # branch; same output as 'stock' at matched seeds) or 'stock' (model.generate)
+    'DECODING_ENGINE': 'static_cache',
+    
+    # KV cache the static_cache engine keeps between requests: decoder rows
+    # (two per prompt with guidance) and steps (50 per second of audio).
+    # Larger requests get a cache of their own that is freed when they finish
+    'STATIC_CACHE_MAX_ROWS': 8,
+    'STATIC_CACHE_MAX_LENGTH': 501,
+    
     # Model descriptions
     'MODELS': {
         'small': {
@@ -131,6 +141,71 @@ PROMPT_TEMPLATES = {
     ]
 }
 
+# Inference Worker Settings
+INFERENCE_CONFIG = {
+    # Number of inference worker processes (0 = generate inside the web process)
+    'WORKERS': 0,
+    
+    # How generated audio reaches the web tier: 'shared_memory' or 'disk'
+    'AUDIO_HANDOFF': 'shared_memory',
+    
+    # Number of recent clips kept in shared memory for hashing and streaming
+    'BUFFER_CACHE_SIZE': 32,
+    
+    # Generator behind /api/generate: 'musicgen' or 'stub' (deterministic
+    # audio after a simulated delay, for load testing without a model)
+    'GENERATOR': os.environ.get('MUSICGEN_GENERATOR', 'musicgen'),
+    
+    # Simulated stub inference time, in seconds per second of audio
+    'STUB_LATENCY': float(os.environ.get('MUSICGEN_STUB_LATENCY', 0.5))
+}
+
+# Live Event Stream Settings
+EVENTS_CONFIG = {
+    # Seconds between keepalive comments on an idle event stream
+    'HEARTBEAT_SECONDS': 15,
+    
+    # Recent library events kept for clients that reconnect with Last-Event-ID
+    # (generation progress only goes to streams opened for that job)
+    'REPLAY_SIZE': 256,
+    
+    # Undelivered events per client before it is told to reload instead
+    'MAX_PENDING': 256
+}
+
+# Prompt Sweep Settings
+SWEEP_CONFIG = {
+    # Maximum number of clips a single sweep may generate
+    'MAX_JOBS': 256,
+    
+    # Number of prompts generated together in one batched model.generate call
+    'BATCH_SIZE': 4
+}
+
+# Load Test Settings
+LOADTEST_CONFIG = {
+    # Relative share of each endpoint in the request mix
+    'MIX': {
+        'list': 30,
+        'evaluate': 20,
+        'stream': 30,
+        'export': 5,
+        'generate': 15
+    },
+    
+    # Latency targets (p95, milliseconds); generate includes stub inference
+    'SLO_P95_MS': {
+        'list': 300,
+        'evaluate': 300,
+        'stream': 500,
+        'export': 3000,
+        'generate': 5000
+    },
+    
+    # Largest tolerated share of failed requests per endpoint
+    'MAX_ERROR_RATE': 0.01
+}
+
 # Logging Configuration
 LOGGING_CONFIG = {
     'LEVEL': 'INFO',
@@ -0,0 +1,279 @@
+"""
+Decoding Engine Module
+This module implements a MusicGen decoding loop that produces the same tokens
+as `model.generate` at matched seeds while doing less work per step: decoder
+self-attention keys and values live in a preallocated static cache, the
+unconditional classifier-free-guidance branch skips cross-attention entirely,
+and guidance scales of 1 or less decode the conditional batch only.
+"""
+
+import threading
+import logging
+
+import torch
+import torch.nn.functional as F
+from transformers import LogitsProcessorList, TemperatureLogitsWarper, TopKLogitsWarper, TopPLogitsWarper
+
+logger = logging.getLogger(__name__)
+
+ENGINES = ('stock', 'static_cache')
+
+class StaticKVCache:
+    """
+    Self-attention keys and values for every decoder layer, allocated once.
+
+    `generate` concatenates each new key/value onto the past for every layer
+    at every step, which copies the whole cache each time. Here step `t`
+    writes into slot `t` and attention reads the prefix view `[:t + 1]`.
+    """
+
+    def __init__(self, num_layers, rows, num_heads, max_length, head_dim, dtype, device):
+        shape = (num_layers, rows, num_heads, max_length, head_dim)
+        self.keys = torch.empty(shape, dtype=dtype, device=device)
+        self.values = torch.empty(shape, dtype=dtype, device=device)
+
+    def fits(self, rows, max_length, dtype, device):
+        return (self.keys.shape[1] >= rows and self.keys.shape[3] >= max_length
+                and self.keys.dtype == dtype and self.keys.device == device)
+
+    def update(self, layer, rows, position, keys, values):
+        """Store one step's keys/values and return the cached prefix for attention."""
+        self.keys[layer, :rows, :, position] = keys
+        self.values[layer, :rows, :, position] = values
+        return self.keys[layer, :rows, :, :position + 1], self.values[layer, :rows, :, :position + 1]
+
+class StaticCacheDecoder:
+    """
+    MusicGen sampling loop over a static KV cache.
+
+    The loop mirrors `MusicgenForConditionalGeneration.generate` step for step
+    (delay pattern, classifier-free guidance, temperature/top-k/top-p warpers,
+    one `torch.multinomial` draw per step) so the random stream is consumed
+    identically and a seeded run reproduces the stock output.
+
+    The unconditional rows of classifier-free guidance attend to all-zero,
+    fully masked encoder states, so their cross-attention output is the same
+    constant for every row and step. It is computed once per batch instead of
+    projecting and attending over a zero tensor for every request.
+    """
+
+    def __init__(self, model, max_rows=None, max_length=None):
+        self.model = model
+        self.max_rows = max_rows
+        self.max_length = max_length
+        self.decoder = model.decoder.model.decoder
+        self.lm_heads = model.decoder.lm_heads
+        self.config = model.decoder.config
+        self.num_codebooks = self.decoder.num_codebooks
+        self.num_heads = self.config.num_attention_heads
+        self.head_dim = self.config.hidden_size // self.num_heads
+        self._cache = None
+        self._lock = threading.Lock()
+
+    def _kv_cache(self, rows, max_length, dtype, device):
+        """
+        Return a cache with room for `rows` x `max_length`.
+
+        Caches within the `max_rows` x `max_length` budget are kept for the
+        next call, grown to cover every shape seen so far; a larger request
+        gets a cache of its own that is freed when it finishes.
+        """
+        if self._cache is not None and self._cache.fits(rows, max_length, dtype, device):
+            return self._cache
+        if ((self.max_rows is not None and rows > self.max_rows)
+                or (self.max_length is not None and max_length > self.max_length)):
+            return StaticKVCache(len(self.decoder.layers), rows, self.num_heads, max_length,
+                                 self.head_dim, dtype, device)
+
+        if self._cache is not None and self._cache.keys.dtype == dtype and self._cache.keys.device == device:
+            rows = max(rows, self._cache.keys.shape[1])
+            max_length = max(max_length, self._cache.keys.shape[3])
+        self._cache = None
+        self._cache = StaticKVCache(len(self.decoder.layers), rows, self.num_heads, max_length,
+                                    self.head_dim, dtype, device)
+        return self._cache
+
+    def release(self):
+        """Free the kept KV cache; the next call allocates a new one."""
+        with self._lock:
+            cache, self._cache = self._cache, None
+            if cache is not None and cache.keys.is_cuda:
+                del cache
+                torch.cuda.empty_cache()
+
+    def _split_heads(self, states):
+        rows, length, _ = states.shape
+        return states.view(rows, length, self.num_heads, self.head_dim).transpose(1, 2)
+
+    def _merge_heads(self, states):
+        rows, _, length, _ = states.shape
+        return states.transpose(1, 2).reshape(rows, length, self.config.hidden_size)
+
+    def _cross_attention_inputs(self, hidden_states, attention_mask):
+        """Project the conditional encoder states to per-layer keys/values once."""
+        model = self.model
+        if (model.text_encoder.config.hidden_size != self.config.hidden_size
+                and self.config.cross_attention_hidden_size is None):
+            hidden_states = model.enc_to_dec_proj(hidden_states)
+        hidden_states = hidden_states * attention_mask[..., None]
+
+        keys, values = [], []
+        for layer in self.decoder.layers:
+            keys.append(self._split_heads(layer.encoder_attn.k_proj(hidden_states)))
+            values.append(self._split_heads(layer.encoder_attn.v_proj(hidden_states)))
+
+        mask = None
+        if not attention_mask.bool().all():
+            mask = torch.zeros(attention_mask.shape, dtype=hidden_states.dtype, device=hidden_states.device)
+            mask = mask.masked_fill(~attention_mask.bool(), torch.finfo(hidden_states.dtype).min)[:, None, None, :]
+        return keys, values, mask
+
+    def _null_cross_attention(self, dtype, device):
+        """
+        Cross-attention output of the unconditional branch, one vector per layer.
+
+        Every key of a zeroed encoder state is identical, so attention weights
+        are uniform and the output reduces to out_proj(v_proj(0)).
+        """
+        null_state = torch.zeros((1, 1, self.config.hidden_size), dtype=dtype, device=device)
+        return [layer.encoder_attn.out_proj(layer.encoder_attn.v_proj(null_state)) for layer in self.decoder.layers]
+
+    def _step(self, columns, position, batch_size, rows, cache, cross, null_cross):
+        """Run the decoder on one token per codebook and return (rows * codebooks, vocab) logits."""
+        cross_keys, cross_values, cross_mask = cross
+        inputs = columns.view(batch_size, self.num_codebooks)
+        hidden = sum([self.decoder.embed_tokens[codebook](inputs[:, codebook, None])
+                      for codebook in range(self.num_codebooks)])
+        hidden = hidden + self.decoder.embed_positions.weights[position]
+        if rows > batch_size:
+            hidden = hidden.repeat(2, 1, 1)
+
+        for index, layer in enumerate(self.decoder.layers):
+            residual = hidden
+            states = layer.self_attn_layer_norm(hidden)
+            attention = layer.self_attn
+            keys, values = cache.update(index, rows, position,
+                                        attention.k_proj(states).view(rows, self.num_heads, self.head_dim),
+                                        attention.v_proj(states).view(rows, self.num_heads, self.head_dim))
+            states = F.scaled_dot_product_attention(self._split_heads(attention.q_proj(states)), keys, values)
+            hidden = residual + attention.out_proj(self._merge_heads(states))
+
+            # Only the conditional rows attend to the prompt
+            residual = hidden
+            attention = layer.encoder_attn
+            states = layer.encoder_attn_layer_norm(hidden[:batch_size])
+            states = F.scaled_dot_product_attention(self._split_heads(attention.q_proj(states)),
+                                                    cross_keys[index], cross_values[index], attn_mask=cross_mask)
+            states = attention.out_proj(self._merge_heads(states))
+            if rows > batch_size:
+                states = torch.cat([states, null_cross[index].expand(batch_size, -1, -1)])
+            hidden = residual + states
+
+            residual = hidden
+            states = layer.fc2(layer.activation_fn(layer.fc1(layer.final_layer_norm(hidden))))
+            hidden = residual + states
+
+        hidden = self.decoder.layer_norm(hidden)
+        logits = torch.stack([head(hidden) for head in self.lm_heads], dim=1)
+        return logits.reshape(rows * self.num_codebooks, -1)
+
+    @torch.no_grad()
+    def generate(self, hidden_states, attention_mask, max_new_tokens, guidance_scale=3.0,
+                 temperature=1.0, top_k=250, top_p=0.9, progress=None, generators=None):
+        """
+        Sample audio for a batch of encoded prompts.
+
+        Args:
+            hidden_states (torch.Tensor): Text encoder states (batch, seq_len, hidden)
+            attention_mask (torch.Tensor): Prompt attention mask (batch, seq_len)
+            max_new_tokens (int): Number of decoding steps
+            guidance_scale (float): Classifier-free guidance scale; 1 or less
+                                    decodes the conditional batch only
+            temperature (float): Sampling temperature
+            top_k (int): Top-k sampling parameter
+            top_p (float): Top-p (nucleus) sampling parameter
+            progress (callable): Called with the number of steps decoded so far
+            generators (list): Optional torch.Generator per batch row. Each row
+                               then samples from its own stream, so its audio
+                               does not depend on the rest of the batch and
+                               matches a batch of one seeded the same way
+
+        Returns:
+            torch.Tensor: Audio values (batch, channels, samples), as `generate` returns
+        """
+        with self._lock:
+            codes = self._sample_codes(hidden_states, attention_mask, max_new_tokens, guidance_scale,
+                                       temperature, top_k, top_p, progress, generators)
+            if generators is None:
+                return self._decode_audio(codes)
+            # Batched EnCodec convolutions round differently from a batch of one
+            return torch.cat([self._decode_audio(row) for row in codes.split(self.num_codebooks)])
+
+    def _sample_codes(self, hidden_states, attention_mask, max_new_tokens, guidance_scale,
+                      temperature, top_k, top_p, progress, generators):
+        generation_config = self.model.generation_config
+        if generation_config.eos_token_id is not None:
+            raise ValueError("The static cache engine does not support early stopping on an EOS token")
+
+        batch_size = hidden_states.shape[0]
+        guided = guidance_scale is not None and guidance_scale > 1
+        rows = 2 * batch_size if guided else batch_size
+        max_length = max_new_tokens + 1
+        device = hidden_states.device
+        dtype = self.lm_heads[0].weight.dtype
+        hidden_states = hidden_states.to(dtype)
+
+        start_token = generation_config.decoder_start_token_id
+        tokens = torch.full((batch_size * self.num_codebooks, 1), start_token, dtype=torch.long, device=device)
+        tokens, pattern = self.model.decoder.build_delay_pattern_mask(tokens, pad_token_id=start_token,
+                                                                      max_length=max_length)
+        sequence = torch.empty((batch_size * self.num_codebooks, max_length), dtype=torch.long, device=device)
+        sequence[:, :tokens.shape[1]] = tokens
+
+        # Same warpers, in the same order, as `generate` builds for these parameters
+        warpers = LogitsProcessorList()
+        if temperature is not None and temperature != 1.0:
+            warpers.append(TemperatureLogitsWarper(temperature))
+        if top_k is not None and top_k != 0:
+            warpers.append(TopKLogitsWarper(top_k=top_k, min_tokens_to_keep=1))
+        if top_p is not None and top_p < 1.0:
+            warpers.append(TopPLogitsWarper(top_p=top_p, min_tokens_to_keep=1))
+
+        cache = self._kv_cache(rows, max_length, dtype, device)
+        cross = self._cross_attention_inputs(hidden_states, attention_mask)
+        null_cross = self._null_cross_attention(dtype, device) if guided else None
+        split = batch_size * self.num_codebooks
+
+        for position in range(max_length - 1):
+            columns = torch.where(pattern[:, position] == -1, sequence[:, position], pattern[:, position])
+            scores = self._step(columns, position, batch_size, rows, cache, cross, null_cross)
+            if guided:
+                conditional, unconditional = scores.split(split, dim=0)
+                scores = unconditional + (conditional - unconditional) * guidance_scale
+            scores = warpers(sequence[:, :position + 1], scores)
+            probs = F.softmax(scores, dim=-1)
+            if generators is None:
+                sampled = torch.multinomial(probs, num_samples=1)
+            else:
+                # Rows are batch-major, one block of codebooks per batch entry
+                sampled = torch.cat([torch.multinomial(block, num_samples=1, generator=generator)
+                                     for block, generator in zip(probs.split(self.num_codebooks), generators)])
+            sequence[:, position + 1] = sampled.squeeze(1)
+            if progress is not None:
+                progress(position + 1)
+
+        return self.model.decoder.apply_delay_pattern_mask(sequence, pattern)
+
+    def _decode_audio(self, codes):
+        """Drop the delay-pattern padding and decode codes to audio with EnCodec."""
+        batch_size = codes.shape[0] // self.num_codebooks
+        codes = codes[codes != self.model.generation_config.pad_token_id].reshape(batch_size, self.num_codebooks, -1)
+        codes = codes[None, ...]
+        audio_scales = [None] * batch_size
+
+        audio_encoder = self.model.audio_encoder
+        if self.config.audio_channels == 1:
+            return audio_encoder.decode(codes, audio_scales=audio_scales).audio_values
+        left = audio_encoder.decode(codes[:, :, ::2, :], audio_scales=audio_scales).audio_values
+        right = audio_encoder.decode(codes[:, :, 1::2, :], audio_scales=audio_scales).audio_values
+        return torch.cat([left, right], dim=1)
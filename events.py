@@ -0,0 +1,355 @@
+"""
+Live Events Module
+This module fans out small change events (new music files, new evaluations,
+updated aggregates and generation progress) to browsers over server-sent
+events, so open pages apply deltas instead of re-fetching the library.
+"""
+
+import json
+import time
+import threading
+import logging
+from collections import deque
+
+from sqlalchemy import func, case
+
+from config import EVENTS_CONFIG
+from models import db, MusicFile, Evaluation
+
+logger = logging.getLogger(__name__)
+
+def _frame(event_id, event, data):
+    """
+    Encode one event in the text/event-stream wire format.
+
+    Frames without an id leave the client's Last-Event-ID unchanged.
+    """
+    lines = f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return (lines if event_id is None else f"id: {event_id}\n{lines}").encode('utf-8')
+
+class Subscription:
+    """Pending event frames of one connected client."""
+
+    def __init__(self, max_pending, job_id=None):
+        self.max_pending = max_pending
+        self.job_id = job_id
+        self.closed = False
+        self._frames = deque()
+        self._condition = threading.Condition()
+
+    def push(self, frame, event_id=None):
+        """
+        Queue a frame. A client `max_pending` frames behind has to reload its
+        view anyway, so its backlog is replaced by a `resync` as of `event_id`;
+        the stream stays open, so nothing published during the reload is lost.
+        Job streams just drop their stale progress.
+        """
+        with self._condition:
+            if len(self._frames) >= self.max_pending:
+                self._frames.clear()
+                if self.job_id is None:
+                    logger.info(f"Event stream fell {self.max_pending} events behind; sending resync")
+                    frame = _frame(event_id, 'resync', {})
+            self._frames.append(frame)
+            self._condition.notify()
+
+    def next_frame(self, timeout):
+        """Wait for the next frame; returns None on timeout or once closed."""
+        with self._condition:
+            if not self._frames and not self.closed:
+                self._condition.wait(timeout)
+            return self._frames.popleft() if self._frames else None
+
+    def close(self):
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+class EventBroker:
+    """
+    In-process publish/subscribe fanout for server-sent events.
+
+    Each event is serialised once at publish time and the same frame is handed
+    to every subscriber, so the cost of an event does not grow with the size
+    of the library. A short replay buffer lets reconnecting clients resume
+    from their Last-Event-ID; clients that fell further behind get a `resync`
+    event telling them to reload their view.
+
+    Generation progress is not part of the library stream: it goes only to
+    streams opened for that job, so a generation costs the other clients
+    nothing and cannot push library changes out of the replay buffer.
+    """
+
+    def __init__(self, replay_size=256, max_pending=256):
+        self.max_pending = max_pending
+        # Event ids are "<epoch>-<sequence>" so ids from before a restart are recognised
+        self._epoch = str(int(time.time()))
+        self._sequence = 0
+        self._replay = deque(maxlen=replay_size)
+        self._subscribers = set()
+        self._job_subscribers = {}
+        self._lock = threading.Lock()
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def publish(self, event, data):
+        """Send an event to every client following the library."""
+        with self._lock:
+            self._sequence += 1
+            event_id = f"{self._epoch}-{self._sequence}"
+            frame = _frame(event_id, event, data)
+            self._replay.append((self._sequence, frame))
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(frame, event_id)
+
+    def publish_to_job(self, job_id, event, data):
+        """Send an event only to the streams following one job; it is not replayed."""
+        with self._lock:
+            subscribers = list(self._job_subscribers.get(job_id, ()))
+        if not subscribers:
+            return
+        frame = _frame(None, event, data)
+        for subscription in subscribers:
+            subscription.push(frame)
+
+    def subscribe(self, last_event_id=None, job_id=None):
+        """
+        Register a client, replaying what it missed if it is reconnecting.
+
+        Args:
+            last_event_id (str): Last-Event-ID header sent by a reconnecting client
+            job_id (str): Follow the progress of this generation job only,
+                          instead of library changes
+
+        Returns:
+            Subscription: Queue of frames for the client
+        """
+        subscription = Subscription(self.max_pending, job_id)
+        with self._lock:
+            if job_id is not None:
+                self._job_subscribers.setdefault(job_id, set()).add(subscription)
+                return subscription
+            if last_event_id:
+                missed = self._missed_frames(last_event_id)
+                if missed is None:
+                    subscription.push(_frame(f"{self._epoch}-{self._sequence}", 'resync', {}))
+                else:
+                    for frame in missed:
+                        subscription.push(frame)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def _missed_frames(self, last_event_id):
+        """Frames published after `last_event_id`, or None if they are no longer buffered."""
+        epoch, _, sequence = last_event_id.partition('-')
+        if epoch != self._epoch or not sequence.isdigit():
+            return None
+        sequence = int(sequence)
+        if sequence < self._sequence and (not self._replay or self._replay[0][0] > sequence + 1):
+            return None
+        return [frame for number, frame in self._replay if number > sequence]
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+            followers = self._job_subscribers.get(subscription.job_id)
+            if followers is not None:
+                followers.discard(subscription)
+                if not followers:
+                    del self._job_subscribers[subscription.job_id]
+        subscription.close()
+
+    def close(self):
+        """End every open stream, e.g. when the server shuts down."""
+        with self._lock:
+            subscribers = list(self._subscribers)
+            for followers in self._job_subscribers.values():
+                subscribers.extend(followers)
+            self._subscribers.clear()
+            self._job_subscribers.clear()
+        for subscription in subscribers:
+            subscription.close()
+
+    def stream(self, last_event_id=None, heartbeat=15, job_id=None):
+        """Open a response body that streams events until the client disconnects."""
+        return _EventStream(self, self.subscribe(last_event_id, job_id), heartbeat)
+
+class _EventStream:
+    """WSGI response iterable over a subscription; closing it unsubscribes."""
+
+    def __init__(self, broker, subscription, heartbeat):
+        self._broker = broker
+        self._subscription = subscription
+        self._heartbeat = heartbeat
+        self._started = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if not self._started:
+            self._started = True
+            return b"retry: 3000\n\n"
+        if self._subscription.closed:
+            raise StopIteration
+        frame = self._subscription.next_frame(self._heartbeat)
+        # Comment lines keep proxies from closing an idle connection
+        return frame if frame is not None else b": keepalive\n\n"
+
+    def close(self):
+        self._broker.unsubscribe(self._subscription)
+
+def music_delta(music_file):
+    """The fields of a music file that list views display."""
+    return {
+        'id': music_file.id,
+        'filename': music_file.filename,
+        'prompt': music_file.prompt,
+        'created_at': music_file.created_at.isoformat(),
+        'evaluated': music_file.is_evaluated(),
+        'evaluation_count': len(music_file.evaluations),
+        'average_rating': music_file.get_average_rating()
+    }
+
+class LibraryTotals:
+    """
+    Running library-wide counts for the dashboard.
+
+    The counts are loaded with aggregate queries once and then updated from
+    each committed file or evaluation as it is published, so an event costs
+    O(1) instead of a scan of the evaluations table. Rows that were already
+    committed when the counts were loaded are not counted twice.
+    """
+
+    def __init__(self):
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Recompute the counts from the database."""
+        with self._lock:
+            self._load()
+
+    def _load(self):
+        self._music_files, self._last_music_id = db.session.query(
+            func.count(MusicFile.id), func.coalesce(func.max(MusicFile.id), 0)).one()
+        self._evaluations, self._last_evaluation_id = db.session.query(
+            func.count(Evaluation.id), func.coalesce(func.max(Evaluation.id), 0)).one()
+        self._evaluated = {music_id for music_id, in db.session.query(Evaluation.music_id).distinct()}
+        self._distribution = dict(
+            db.session.query(Evaluation.overall_rating, func.count(Evaluation.id))
+            .filter(Evaluation.overall_rating.isnot(None))
+            .group_by(Evaluation.overall_rating)
+        )
+        self._loaded = True
+
+    def add_music(self, music_files):
+        """Count newly committed music files."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            self._music_files += sum(1 for music_file in music_files if music_file.id > self._last_music_id)
+
+    def add_evaluation(self, evaluation):
+        """Count a newly committed evaluation."""
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            if evaluation.id <= self._last_evaluation_id:
+                return
+            self._evaluations += 1
+            self._evaluated.add(evaluation.music_id)
+            if evaluation.overall_rating is not None:
+                rating = evaluation.overall_rating
+                self._distribution[rating] = self._distribution.get(rating, 0) + 1
+
+    def totals(self):
+        """
+        Returns:
+            dict: File, evaluation and evaluated-file counts, the mean overall
+                  rating and the overall rating distribution
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+            rated = sum(self._distribution.values())
+            return {
+                'music_files': self._music_files,
+                'evaluations': self._evaluations,
+                'evaluated_files': len(self._evaluated),
+                'average_rating': sum(r * n for r, n in self._distribution.items()) / rated if rated else None,
+                'rating_distribution': {str(r): self._distribution.get(r, 0) for r in range(1, 6)}
+            }
+
+def music_deltas():
+    """
+    The list-view fields of every music file, newest first.
+
+    Same fields as `music_delta`, but the evaluation count and mean overall
+    rating come from one aggregate join instead of loading each file's
+    evaluations.
+    """
+    ratings = (
+        db.session.query(
+            Evaluation.music_id,
+            func.count(Evaluation.id).label('count'),
+            # get_average_rating skips unset (NULL or 0) ratings; AVG skips NULLs
+            func.avg(case((Evaluation.overall_rating != 0, Evaluation.overall_rating))).label('average')
+        )
+        .group_by(Evaluation.music_id)
+        .subquery()
+    )
+    rows = (
+        db.session.query(MusicFile.id, MusicFile.filename, MusicFile.prompt, MusicFile.created_at,
+                         ratings.c.count, ratings.c.average)
+        .outerjoin(ratings, ratings.c.music_id == MusicFile.id)
+        .order_by(MusicFile.created_at.desc())
+    )
+    return [{
+        'id': row.id,
+        'filename': row.filename,
+        'prompt': row.prompt,
+        'created_at': row.created_at.isoformat(),
+        'evaluated': bool(row.count),
+        'evaluation_count': row.count or 0,
+        'average_rating': row.average
+    } for row in rows]
+
+def library_totals():
+    """Library-wide counts for the dashboard (see LibraryTotals.totals)."""
+    return running_totals.totals()
+
+def publish_music_created(music_files):
+    """Announce newly committed music files, then the new library totals."""
+    if not music_files:
+        return
+    running_totals.add_music(music_files)
+    for music_file in music_files:
+        event_broker.publish('music_created', music_delta(music_file))
+    event_broker.publish('aggregates', {'music': None, 'totals': library_totals()})
+
+def publish_evaluation_created(evaluation):
+    """Announce a committed evaluation with the updated aggregates of its file."""
+    running_totals.add_evaluation(evaluation)
+    event_broker.publish('evaluation_created', evaluation.to_dict())
+    event_broker.publish('aggregates', {
+        'music': music_delta(evaluation.music_file),
+        'totals': library_totals()
+    })
+
+def publish_generation_progress(job_id, stage, **details):
+    """
+    Report the progress of a generation job to the streams following it.
+
+    Args:
+        job_id (str): Client-chosen id of the job
+        stage (str): 'started', 'decoding', 'saving', 'done' or 'failed'
+    """
+    event_broker.publish_to_job(job_id, 'generation_progress', {'job_id': job_id, 'stage': stage, **details})
+
+# Shared instances used by the web application
+running_totals = LibraryTotals()
+event_broker = EventBroker(replay_size=EVENTS_CONFIG['REPLAY_SIZE'], max_pending=EVENTS_CONFIG['MAX_PENDING'])
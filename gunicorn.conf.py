@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for running the web application in production
+Usage: gunicorn -c gunicorn.conf.py app:app
+"""
+
+import os
+import signal
+
+from config import APP_CONFIG
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{APP_CONFIG['PORT']}")
+
+# A single process: the live event broker, the shared-memory audio cache and
+# the inference pool all live in the web process. Scale with threads, and
+# with INFERENCE_CONFIG['WORKERS'] for generation.
+workers = 1
+worker_class = 'gthread'
+
+# Every open /api/events connection holds a thread for as long as the page is
+# open, so leave headroom above the expected number of browser tabs
+threads = int(os.environ.get('GUNICORN_THREADS', 64))
+
+# gthread workers heartbeat from the main loop, so long generations do not
+# trip the timeout; it only catches a wedged process
+timeout = 120
+graceful_timeout = 10
+keepalive = 5
+
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG')
+errorlog = '-'
+
+def post_worker_init(worker):
+    from app import init_database
+    from events import event_broker
+    init_database()
+
+    # Open event streams would otherwise keep the worker busy past
+    # graceful_timeout, and a killed worker leaks its shared-memory buffers
+    handle_exit = worker.handle_exit
+
+    def close_event_streams(sig, frame):
+        event_broker.close()
+        handle_exit(sig, frame)
+
+    signal.signal(signal.SIGTERM, close_event_streams)
@@ -0,0 +1,135 @@
+"""
+Inference Worker Module
+This module runs MusicGen generation and prompt embedding either inside the
+web process or in a pool of worker processes, so the web tier does not have
+to import torch or hold the model when workers are configured.
+"""
+
+import uuid
+import importlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config import INFERENCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+def _run(function, kwargs, progress=None, relay=None):
+    """
+    Worker entry point; imports MusicGen lazily so only workers load torch.
+    INFERENCE_CONFIG['GENERATOR'] = 'stub' swaps in the load-testing stub.
+
+    In a worker process, progress updates are sent back through `relay`, a
+    (queue, job key) pair, since callbacks cannot cross the process boundary.
+    """
+    module = importlib.import_module('musicgen_stub' if INFERENCE_CONFIG['GENERATOR'] == 'stub' else 'musicgen_api')
+    if relay is not None:
+        queue, key = relay
+        progress = lambda step, total: queue.put((key, step, total))
+    if progress is not None:
+        kwargs = dict(kwargs, progress=progress)
+    return getattr(module, function)(**kwargs)
+
+class InferencePool:
+    """
+    Dispatches generation requests to worker processes.
+
+    With zero workers generation runs in the calling thread, which keeps the
+    original single-process behaviour.
+    """
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._executor = None
+        self._manager = None
+        self._progress_queue = None
+        self._progress_callbacks = {}
+        self._lock = threading.Lock()
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                # CUDA cannot be re-initialised in forked children, so always spawn
+                context = multiprocessing.get_context('spawn')
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._manager = context.Manager()
+                self._progress_queue = self._manager.Queue()
+                threading.Thread(target=self._relay_progress, name='inference-progress', daemon=True).start()
+                logger.info(f"Started {self.workers} inference worker processes")
+            return self._executor
+
+    def _relay_progress(self):
+        """Forward progress updates from workers to the callbacks of their jobs."""
+        queue = self._progress_queue
+        while True:
+            try:
+                update = queue.get()
+            except (EOFError, OSError):
+                return
+            if update is None:
+                return
+            key, step, total = update
+            callback = self._progress_callbacks.get(key)
+            if callback is not None:
+                callback(step, total)
+
+    def _call(self, function, kwargs, progress=None):
+        if self.workers <= 0:
+            return _run(function, kwargs, progress)
+
+        pool = self._pool()
+        if progress is None:
+            return pool.submit(_run, function, kwargs).result()
+
+        key = uuid.uuid4().hex
+        self._progress_callbacks[key] = progress
+        try:
+            return pool.submit(_run, function, kwargs, None, (self._progress_queue, key)).result()
+        finally:
+            self._progress_callbacks.pop(key, None)
+
+    def generate(self, progress=None, **kwargs):
+        """
+        Generate one clip with `generate_music_with_musicgen`.
+
+        Args:
+            progress (callable): Called with (steps decoded, total steps)
+
+        Returns:
+            dict: The generation result
+        """
+        return self._call('generate_music_with_musicgen', kwargs, progress)
+
+    def generate_batch(self, progress=None, **kwargs):
+        """
+        Generate a sweep's clips with `generate_music_batch`.
+
+        Args:
+            progress (callable): Called with (clips generated, total clips)
+
+        Returns:
+            list: One result dict per run
+        """
+        return self._call('generate_music_batch', kwargs, progress)
+
+    def embed_prompts(self, prompts, model_size='small'):
+        """
+        Embed prompts with the MusicGen text encoder (`embed_prompts`).
+
+        Returns:
+            np.ndarray: float32 array of shape (len(prompts), hidden)
+        """
+        return self._call('embed_prompts', {'prompts': list(prompts), 'model_size': model_size})
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._progress_queue.put(None)
+            self._manager.shutdown()
+            self._executor = None
+            self._manager = None
+
+# Shared instance used by the web application
+inference_pool = InferencePool(workers=INFERENCE_CONFIG['WORKERS'])
@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+"""
+Load test the web API against a seeded database with a stubbed generator
+Usage: python loadtest.py --files 1000 --concurrency 16 --duration 60
+       python loadtest.py --server werkzeug --listeners 20
+       python loadtest.py --url http://localhost:8080 --endpoints list stream
+
+Seeds a dedicated database, starts the app (gunicorn by default) with the
+deterministic MusicGen stub, then drives a weighted mix of the list, evaluate,
+stream, export and generate endpoints from concurrent keep-alive clients.
+Clients are closed-loop: each waits for its response before sending the next
+request. Optional listeners hold /api/events open to load the live fanout.
+
+Reports p50/p95/p99 latency and throughput per endpoint and exits non-zero if
+any endpoint misses its target in LOADTEST_CONFIG.
+"""
+
+import argparse
+import hashlib
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+import numpy as np
+import scipy
+
+from config import LOADTEST_CONFIG, INFERENCE_CONFIG, EVALUATION_CONFIG, AUDIO_CONFIG
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENDPOINTS = list(LOADTEST_CONFIG['MIX'])
+
+MOODS = ['calm', 'energetic', 'melancholic', 'uplifting', 'dark', 'playful']
+GENRES = ['jazz', 'ambient', 'baroque', 'techno', 'folk', 'cinematic']
+INSTRUMENTS = ['piano', 'violin', 'synthesizer', 'acoustic guitar', 'saxophone', 'strings']
+
+def make_prompt(rng):
+    return f"{rng.choice(MOODS)} {rng.choice(GENRES)} piece with {rng.choice(INSTRUMENTS)}"
+
+def seed_database(args, music_dir):
+    """
+    Fill a fresh database with music files and evaluations.
+
+    Rows share a small pool of stub clips on disk, each with its own hash, so
+    large libraries stay cheap to seed.
+
+    Returns:
+        list: Ids of the seeded music files
+    """
+    import app as web
+    from sqlalchemy import insert, select
+    from models import db, MusicFile, Evaluation
+    from musicgen_stub import synthesize_clip
+
+    rng = random.Random(args.seed)
+    os.makedirs(music_dir, exist_ok=True)
+    clips = []
+    for index in range(min(args.files, 16)):
+        path = os.path.join(music_dir, f"seed_{index:02d}.wav")
+        scipy.io.wavfile.write(path, rate=AUDIO_CONFIG['DEFAULT_SAMPLE_RATE'],
+                               data=synthesize_clip(args.seed * 100 + index, args.clip_seconds))
+        clips.append(path)
+
+    start = datetime.utcnow() - timedelta(minutes=args.files)
+    music_rows = [{
+        'filename': f"seed_{index:06d}.wav",
+        'filepath': clips[index % len(clips)],
+        'file_hash': hashlib.md5(f"loadtest-{args.seed}-{index}".encode('utf-8')).hexdigest(),
+        'prompt': make_prompt(rng),
+        'generation_params': json.dumps({
+            'duration': args.clip_seconds,
+            'temperature': rng.choice([0.8, 1.0, 1.2]),
+            'model_size': rng.choice(['small', 'medium', 'large']),
+            'guidance_scale': 3.0
+        }),
+        'created_at': start + timedelta(minutes=index)
+    } for index in range(args.files)]
+
+    criteria = [criterion['id'] for criterion in EVALUATION_CONFIG['CRITERIA']]
+    with web.app.app_context():
+        db.create_all()
+        if music_rows:
+            db.session.execute(insert(MusicFile), music_rows)
+        music_ids = list(db.session.scalars(select(MusicFile.id).order_by(MusicFile.id)))
+
+        evaluation_rows = []
+        for music_id in music_ids:
+            for _ in range(rng.randint(0, 2 * args.evaluations)):
+                row = {criterion: rng.randint(1, 5) for criterion in criteria}
+                row.update(music_id=music_id, overall_rating=rng.randint(1, 5),
+                           evaluator_name=f"rater_{rng.randrange(20):02d}", comments='')
+                evaluation_rows.append(row)
+        if evaluation_rows:
+            db.session.execute(insert(Evaluation), evaluation_rows)
+        db.session.commit()
+    web.init_database()
+
+    print(f"Seeded {len(music_ids)} music files and {len(evaluation_rows)} evaluations")
+    return music_ids
+
+def start_server(args, workdir, database_url):
+    """Launch the app with the stub generator and wait until it answers."""
+    env = dict(os.environ,
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])),
+               DATABASE_URL=database_url,
+               MUSICGEN_GENERATOR='stub',
+               MUSICGEN_STUB_LATENCY=str(args.stub_latency))
+    if args.server == 'gunicorn':
+        command = [sys.executable, '-m', 'gunicorn', '-c', os.path.join(ROOT, 'gunicorn.conf.py'),
+                   '--bind', f"127.0.0.1:{args.port}", '--threads', str(args.threads), 'app:app']
+    else:
+        # The threaded development server that `python app.py` runs, minus the reloader
+        command = [sys.executable, '-c',
+                   f"import app; app.init_database(); app.app.run(port={args.port}, threaded=True)"]
+
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}; see {log.name}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', args.port, timeout=2)
+            connection.request('GET', '/api/stats/summary')
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server did not start within 60 seconds; see {log.name}")
+
+def build_request(endpoint, rng, music_ids, args):
+    """Return (method, path, JSON body) for one request to `endpoint`."""
+    if endpoint == 'list':
+        return 'GET', '/api/music/list', None
+    if endpoint == 'stream':
+        return 'GET', f"/api/music/{rng.choice(music_ids)}/stream", None
+    if endpoint == 'export':
+        return 'GET', '/api/export/evaluations', None
+    if endpoint == 'evaluate':
+        body = {criterion['id']: rng.randint(1, 5) for criterion in EVALUATION_CONFIG['CRITERIA']}
+        body.update(music_id=rng.choice(music_ids), overall_rating=rng.randint(1, 5),
+                    evaluator_name=f"loadtest_{rng.randrange(20):02d}")
+        return 'POST', '/api/evaluate', body
+    return 'POST', '/api/generate', {'prompt': make_prompt(rng), 'duration': args.generate_duration,
+                                     'temperature': 1.0, 'model': 'small'}
+
+def run_client(index, args, host, port, music_ids, mix, record_from, stop_at, result):
+    """Issue requests from the mix over one keep-alive connection until `stop_at`."""
+    rng = random.Random(args.seed * 1000 + index)
+    endpoints, weights = zip(*mix.items())
+    connection = http.client.HTTPConnection(host, port, timeout=args.timeout)
+    while time.monotonic() < stop_at:
+        endpoint = rng.choices(endpoints, weights)[0]
+        method, path, body = build_request(endpoint, rng, music_ids, args)
+        sent_at = time.monotonic()
+        start = time.perf_counter()
+        try:
+            connection.request(method, path, body=json.dumps(body) if body is not None else None,
+                               headers={'Content-Type': 'application/json'} if body is not None else {})
+            response = connection.getresponse()
+            response.read()
+            ok = response.status < 400
+        except (OSError, http.client.HTTPException):
+            connection.close()
+            connection = http.client.HTTPConnection(host, port, timeout=args.timeout)
+            ok = False
+        elapsed = time.perf_counter() - start
+        if sent_at >= record_from:
+            result['latencies'][endpoint].append(elapsed)
+            if not ok:
+                result['errors'][endpoint] += 1
+    connection.close()
+
+def run_listener(host, port, connections, counts, index):
+    """Hold /api/events open and count the events delivered."""
+    connection = http.client.HTTPConnection(host, port)
+    connections.append(connection)
+    try:
+        connection.request('GET', '/api/events')
+        response = connection.getresponse()
+        for line in response:
+            if line.startswith(b'event:'):
+                counts[index] += 1
+    except (OSError, http.client.HTTPException, ValueError):
+        pass
+
+def summarize(results, mix, measured_seconds):
+    """Merge per-client samples into per-endpoint latency percentiles and throughput."""
+    report = {}
+    for endpoint in mix:
+        latencies = np.array([sample for result in results for sample in result['latencies'][endpoint]]) * 1000
+        errors = sum(result['errors'][endpoint] for result in results)
+        count = len(latencies)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if count else (None, None, None)
+        target = LOADTEST_CONFIG['SLO_P95_MS'][endpoint]
+        error_rate = errors / count if count else 0.0
+        report[endpoint] = {
+            'requests': count,
+            'errors': errors,
+            'throughput': count / measured_seconds,
+            'p50_ms': p50,
+            'p95_ms': p95,
+            'p99_ms': p99,
+            'slo_p95_ms': target,
+            'slo_met': bool(count and p95 <= target and error_rate <= LOADTEST_CONFIG['MAX_ERROR_RATE'])
+        }
+    return report
+
+def print_report(report, args, measured_seconds, listener_counts):
+    def ms(value):
+        return f"{value:>8.1f}" if value is not None else f"{'-':>8}"
+
+    print(f"\n{args.server if not args.url else args.url}: {args.concurrency} clients, "
+          f"{args.listeners} event listeners, {measured_seconds:.0f}s measured")
+    print(f"\n{'endpoint':<10}  {'requests':>8}  {'errors':>6}  {'req/s':>7}  {'p50 ms':>8}  "
+          f"{'p95 ms':>8}  {'p99 ms':>8}  {'p95 SLO':>8}  met")
+    print("-" * 84)
+    for endpoint, row in report.items():
+        print(f"{endpoint:<10}  {row['requests']:>8}  {row['errors']:>6}  {row['throughput']:>7.1f}  "
+              f"{ms(row['p50_ms'])}  {ms(row['p95_ms'])}  {ms(row['p99_ms'])}  {row['slo_p95_ms']:>8}  "
+              f"{'yes' if row['slo_met'] else 'NO'}")
+    print("-" * 84)
+    total = sum(row['requests'] for row in report.values())
+    print(f"{'total':<10}  {total:>8}  {sum(row['errors'] for row in report.values()):>6}  "
+          f"{total / measured_seconds:>7.1f}")
+    if listener_counts:
+        print(f"events delivered per listener: min {min(listener_counts)}, max {max(listener_counts)}")
+    print()
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the API with a stubbed generator')
+    parser.add_argument('--files', type=int, default=500, help='Music files to seed (default: 500)')
+    parser.add_argument('--evaluations', type=int, default=3, help='Average evaluations per file (default: 3)')
+    parser.add_argument('--clip-seconds', type=float, default=2.0, help='Length of seeded clips (default: 2)')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients (default: 8)')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds (default: 30)')
+    parser.add_argument('--warmup', type=float, default=5, help='Unmeasured seconds first (default: 5)')
+    parser.add_argument('--listeners', type=int, default=0, help='Open /api/events connections (default: 0)')
+    parser.add_argument('--endpoints', nargs='+', choices=ENDPOINTS, default=ENDPOINTS,
+                       help='Endpoints to include in the mix (default: all)')
+    parser.add_argument('--generate-duration', type=float, default=2.0,
+                       help='Audio seconds per generate request (default: 2)')
+    parser.add_argument('--stub-latency', type=float, default=INFERENCE_CONFIG['STUB_LATENCY'],
+                       help='Simulated inference seconds per audio second '
+                            f"(default: {INFERENCE_CONFIG['STUB_LATENCY']})")
+    parser.add_argument('--server', choices=['gunicorn', 'werkzeug'], default='gunicorn',
+                       help='Server to start: gunicorn.conf.py or the Flask development server')
+    parser.add_argument('--threads', type=int, default=64, help='Gunicorn threads (default: 64)')
+    parser.add_argument('--port', type=int, default=8099, help='Port for the started server (default: 8099)')
+    parser.add_argument('--url', type=str, help='Test an already running server instead (no seeding)')
+    parser.add_argument('--workdir', type=str, default='loadtest',
+                       help='Directory for the seeded database, clips and server log (default: loadtest)')
+    parser.add_argument('--timeout', type=float, default=60, help='Per-request timeout (default: 60)')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for data and request mix (default: 0)')
+    parser.add_argument('--json', type=str, help='Also write the report to this JSON file')
+    args = parser.parse_args()
+
+    mix = {endpoint: LOADTEST_CONFIG['MIX'][endpoint] for endpoint in args.endpoints}
+    process = None
+    if args.url:
+        target = urlparse(args.url)
+        host, port = target.hostname, target.port or 80
+        connection = http.client.HTTPConnection(host, port, timeout=args.timeout)
+        connection.request('GET', '/api/music/list')
+        music_ids = [music['id'] for music in json.loads(connection.getresponse().read())]
+    else:
+        if args.server == 'gunicorn' and args.threads <= args.concurrency + args.listeners:
+            print(f"Warning: {args.threads} threads cannot serve {args.concurrency} clients "
+                  f"and {args.listeners} listeners at once")
+        workdir = os.path.abspath(args.workdir)
+        os.makedirs(workdir, exist_ok=True)
+        database_path = os.path.join(workdir, 'loadtest.db')
+        if os.path.exists(database_path):
+            os.remove(database_path)
+        database_url = f"sqlite:///{database_path}"
+        os.environ['DATABASE_URL'] = database_url
+        music_ids = seed_database(args, os.path.join(workdir, 'music'))
+        host, port = '127.0.0.1', args.port
+        process = start_server(args, workdir, database_url)
+
+    if not music_ids and {'evaluate', 'stream'} & set(mix):
+        sys.exit("No music files to evaluate or stream; seed with --files or add music to the server")
+
+    try:
+        listener_counts = [0] * args.listeners
+        listener_connections = []
+        listeners = [threading.Thread(target=run_listener, args=(host, port, listener_connections,
+                                                                 listener_counts, index), daemon=True)
+                     for index in range(args.listeners)]
+        for listener in listeners:
+            listener.start()
+
+        record_from = time.monotonic() + args.warmup
+        stop_at = record_from + args.duration
+        results = [{'latencies': defaultdict(list), 'errors': defaultdict(int)} for _ in range(args.concurrency)]
+        clients = [threading.Thread(target=run_client, args=(index, args, host, port, music_ids, mix,
+                                                             record_from, stop_at, results[index]))
+                   for index in range(args.concurrency)]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        # In-flight requests finish after stop_at, so measure up to the last one
+        measured_seconds = max(time.monotonic(), stop_at) - record_from
+
+        for connection in listener_connections:
+            if connection.sock is not None:
+                connection.sock.shutdown(socket.SHUT_RDWR)
+        for listener in listeners:
+            listener.join(timeout=5)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+
+    report = summarize(results, mix, measured_seconds)
+    print_report(report, args, measured_seconds, listener_counts)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'server': args.url or args.server, 'files': len(music_ids), 'concurrency': args.concurrency,
+                       'listeners': args.listeners, 'measured_seconds': measured_seconds,
+                       'events_per_listener': listener_counts, 'endpoints': report}, f, indent=2)
+    sys.exit(0 if all(row['slo_met'] for row in report.values()) else 1)
+
+if __name__ == "__main__":
+    main()
@@ -74,4 +74,34 @@ class Evaluation(db.Model):
             'comments': self.comments,
             'evaluator_name': self.evaluator_name,
             'created_at': self.created_at.isoformat()
-        }
\ No newline at end of file
+        }
+
+class PromptEmbedding(db.Model):
+    __tablename__ = 'prompt_embeddings'
+    
+    music_id = db.Column(db.Integer, db.ForeignKey('music_files.id'), primary_key=True)
+    dimension = db.Column(db.Integer, nullable=False)
+    vector = db.Column(db.LargeBinary, nullable=False)  # float32 bytes of the mean-pooled T5 encoder output
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+class Sweep(db.Model):
+    __tablename__ = 'sweeps'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(255))
+    spec = db.Column(db.Text)  # JSON string of the templates, values and parameter grid
+    model_size = db.Column(db.String(20))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    runs = db.relationship('SweepRun', backref='sweep', lazy=True, cascade='all, delete-orphan')
+
+class SweepRun(db.Model):
+    __tablename__ = 'sweep_runs'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    sweep_id = db.Column(db.Integer, db.ForeignKey('sweeps.id'), nullable=False)
+    music_id = db.Column(db.Integer, db.ForeignKey('music_files.id'), nullable=False)
+    coordinates = db.Column(db.Text)  # JSON string of the template bindings and sampling parameters
+    
+    music_file = db.relationship('MusicFile')
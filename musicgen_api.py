@@ -10,8 +10,14 @@ import scipy
 import numpy as np
 from datetime import datetime
 from transformers import MusicgenForConditionalGeneration, AutoProcessor
+from transformers.modeling_outputs import BaseModelOutput
+from transformers.generation.streamers import BaseStreamer
 import logging
 
+from audio_buffers import write_shared_audio
+from config import MUSICGEN_CONFIG
+from decoding import ENGINES, StaticCacheDecoder
+
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -19,6 +25,7 @@ logger = logging.getLogger(__name__)
 # Global variable to cache the model
 _cached_model = None
 _cached_processor = None
+_cached_engine = None
 
 def load_musicgen_model(model_size='small', device=None):
     """
@@ -65,8 +72,165 @@ def load_musicgen_model(model_size='small', device=None):
     
     return _cached_model, _cached_processor, device
 
+def encode_text_prompts(model, inputs):
+    """
+    Run the T5 text encoder over tokenized prompts.
+    
+    Args:
+        model: Loaded MusicGen model
+        inputs: Processor output with 'input_ids' and 'attention_mask'
+    
+    Returns:
+        torch.Tensor: Encoder hidden states of shape (batch, seq_len, hidden)
+    """
+    with torch.no_grad():
+        return model.text_encoder(
+            input_ids=inputs['input_ids'],
+            attention_mask=inputs['attention_mask']
+        ).last_hidden_state
+
+def encoder_generate_kwargs(hidden_states, attention_mask, guidance_scale):
+    """
+    Build `generate` kwargs that reuse precomputed encoder hidden states.
+    
+    When `encoder_outputs` is passed, MusicGen skips its own text encoding, so
+    the null (unconditional) half used by classifier-free guidance has to be
+    appended here, exactly as `generate` would.
+    """
+    if guidance_scale is not None and guidance_scale > 1:
+        hidden_states = torch.cat([hidden_states, torch.zeros_like(hidden_states)], dim=0)
+        attention_mask = torch.cat([attention_mask, torch.zeros_like(attention_mask)], dim=0)
+    return {
+        'encoder_outputs': BaseModelOutput(last_hidden_state=hidden_states),
+        'attention_mask': attention_mask
+    }
+
+def get_decoding_engine(model):
+    """
+    Return the static-cache decoding engine for a model, reusing its KV cache
+    up to MUSICGEN_CONFIG['STATIC_CACHE_MAX_ROWS'] x ['STATIC_CACHE_MAX_LENGTH'].
+    """
+    global _cached_engine
+    
+    if _cached_engine is None or _cached_engine.model is not model:
+        if _cached_engine is not None:
+            _cached_engine.release()
+        _cached_engine = StaticCacheDecoder(model, max_rows=MUSICGEN_CONFIG['STATIC_CACHE_MAX_ROWS'],
+                                            max_length=MUSICGEN_CONFIG['STATIC_CACHE_MAX_LENGTH'])
+    return _cached_engine
+
+class _StepStreamer(BaseStreamer):
+    """Streamer that only counts the decoding steps of `model.generate`."""
+    
+    def __init__(self, on_step):
+        self.on_step = on_step
+        self.step = 0
+        self.started = False
+    
+    def put(self, value):
+        # The first call carries the decoder start tokens, not a decoded step
+        if self.started:
+            self.step += 1
+            self.on_step(self.step)
+        self.started = True
+    
+    def end(self):
+        pass
+
+def step_reporter(progress, total):
+    """
+    Turn a progress(step, total) callback into a per-decoding-step callable.
+    
+    The callback fires at most once per whole percent, so long generations
+    report about a hundred updates however many steps they decode.
+    """
+    if progress is None:
+        return None
+    last = {'percent': -1}
+    
+    def on_step(step):
+        percent = step * 100 // total
+        if percent != last['percent']:
+            last['percent'] = percent
+            progress(step, total)
+    return on_step
+
+def decode_audio(model, engine, input_ids, hidden_states, attention_mask, max_new_tokens,
+                 guidance_scale, temperature, top_k, top_p, on_step=None, generators=None):
+    """
+    Sample audio from encoded prompts with the selected decoding engine.
+    
+    Args:
+        engine (str): 'stock' runs `model.generate`; 'static_cache' runs the
+                      optimized loop, which gives the same output at a matched seed
+        on_step (callable): Called with the number of steps decoded so far
+        generators (list): One torch.Generator per batch row ('static_cache'
+                           only; `model.generate` samples from the global one)
+    
+    Returns:
+        torch.Tensor: Audio values of shape (batch, channels, samples)
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown decoding engine: {engine}")
+    if generators is not None and engine != 'static_cache':
+        raise ValueError("Per-row generators need the static_cache decoding engine")
+    
+    if engine == 'static_cache':
+        return get_decoding_engine(model).generate(
+            hidden_states, attention_mask, max_new_tokens,
+            guidance_scale=guidance_scale,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            progress=on_step,
+            generators=generators
+        )
+    
+    with torch.no_grad():
+        return model.generate(
+            input_ids=input_ids,
+            **encoder_generate_kwargs(hidden_states, attention_mask, guidance_scale),
+            do_sample=True,
+            guidance_scale=guidance_scale,
+            max_new_tokens=max_new_tokens,
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            streamer=_StepStreamer(on_step) if on_step is not None else None
+        )
+
+def pool_prompt_embeddings(hidden_states, attention_mask):
+    """
+    Mean-pool encoder hidden states over the non-padding tokens.
+    
+    Returns:
+        np.ndarray: float32 array of shape (batch, hidden)
+    """
+    mask = attention_mask.unsqueeze(-1).to(hidden_states.dtype)
+    pooled = (hidden_states * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+    return pooled.float().cpu().numpy()
+
+def embed_prompts(prompts, model_size='small'):
+    """
+    Compute prompt embeddings with the MusicGen text encoder.
+    
+    Args:
+        prompts (list): Text prompts
+        model_size (str): Model size whose text encoder to use
+    
+    Returns:
+        np.ndarray: float32 array of shape (len(prompts), hidden)
+    """
+    model, processor, device = load_musicgen_model(model_size)
+    inputs = processor(text=list(prompts), padding=True, return_tensors="pt")
+    if device != "cpu":
+        inputs = inputs.to(device)
+    hidden_states = encode_text_prompts(model, inputs)
+    return pool_prompt_embeddings(hidden_states, inputs['attention_mask'])
+
 def generate_music_with_musicgen(prompt, duration=10, temperature=1.0, top_k=250, top_p=0.9, 
-                                 guidance_scale=3.0, model_size='small'):
+                                 guidance_scale=3.0, model_size='small', output='file', engine=None,
+                                 progress=None):
     """
     Generate music using Meta's MusicGen model.
     
@@ -78,17 +242,28 @@ def generate_music_with_musicgen(prompt, duration=10, temperature=1.0, top_k=250
         top_p (float): Top-p (nucleus) sampling parameter
         guidance_scale (float): Classifier-free guidance scale
         model_size (str): Model size to use ('small', 'medium', 'large')
+        output (str): 'file' writes the WAV to 'filepath'; 'shared_memory'
+                      leaves it in a shared-memory segment ('shared_memory'
+                      handle) for the caller to hash, serve and persist
+        engine (str): Decoding engine, 'static_cache' or 'stock' (default
+                      MUSICGEN_CONFIG['DECODING_ENGINE'])
+        progress (callable): Called with (steps decoded, total steps) as
+                             decoding advances, about once per percent
     
     Returns:
-        dict: Contains 'filename', 'filepath', and generation metadata
+        dict: Contains 'filename', 'filepath', 'transfers' (copies of the clip
+              bytes made here) and generation metadata
     """
     
+    engine = engine or MUSICGEN_CONFIG['DECODING_ENGINE']
+    
     try:
         # Load model and processor
         model, processor, device = load_musicgen_model(model_size)
         
         logger.info(f"Generating music with prompt: '{prompt}'")
-        logger.info(f"Parameters: duration={duration}s, temperature={temperature}, guidance_scale={guidance_scale}")
+        logger.info(f"Parameters: duration={duration}s, temperature={temperature}, "
+                    f"guidance_scale={guidance_scale}, engine={engine}")
         
         # Calculate max_new_tokens based on duration
         # MusicGen uses ~50 tokens per second of audio
@@ -105,34 +280,40 @@ def generate_music_with_musicgen(prompt, duration=10, temperature=1.0, top_k=250
         if device != "cpu":
             inputs = inputs.to(device)
         
+        # Encode the prompt once; the hidden states also give the prompt embedding
+        hidden_states = encode_text_prompts(model, inputs)
+        
         # Generate audio
-        with torch.no_grad():
-            audio_values = model.generate(
-                **inputs,
-                do_sample=True,
-                guidance_scale=guidance_scale,
-                max_new_tokens=max_new_tokens,
-                temperature=temperature,
-                top_k=top_k,
-                top_p=top_p
-            )
+        audio_values = decode_audio(model, engine, inputs['input_ids'], hidden_states, inputs['attention_mask'],
+                                    max_new_tokens, guidance_scale, temperature, top_k, top_p,
+                                    on_step=step_reporter(progress, max_new_tokens))
         
         # Get sampling rate
         sampling_rate = model.config.audio_encoder.sampling_rate
         
-        # Convert to numpy and move to CPU
-        audio_array = audio_values[0, 0].cpu().numpy()
-        
         # Generate filename with timestamp
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
         filename = f"generated_{timestamp}.wav"
         filepath = os.path.join('music', filename)
         
-        # Ensure music directory exists
-        os.makedirs('music', exist_ok=True)
-        
-        # Save audio file
-        scipy.io.wavfile.write(filepath, rate=sampling_rate, data=audio_array)
+        audio = audio_values[0, 0]
+        shared_handle = None
+        if output == 'shared_memory':
+            # One copy, straight from the output tensor into shared memory
+            shared_handle, transfers = write_shared_audio(audio, sampling_rate)
+        else:
+            # Convert to numpy and move to CPU
+            audio_array = audio.cpu().numpy()
+            transfers = []
+            if audio.device.type != 'cpu':
+                transfers.append({'stage': 'tensor_to_host', 'bytes': audio_array.nbytes, 'copied': True})
+            
+            # Ensure music directory exists
+            os.makedirs('music', exist_ok=True)
+            
+            # Save audio file
+            scipy.io.wavfile.write(filepath, rate=sampling_rate, data=audio_array)
+            transfers.append({'stage': 'write_file', 'bytes': os.path.getsize(filepath), 'copied': True})
         
         logger.info(f"Music generated successfully: {filename}")
         
@@ -144,13 +325,142 @@ def generate_music_with_musicgen(prompt, duration=10, temperature=1.0, top_k=250
             'prompt': prompt,
             'model_size': model_size,
             'temperature': temperature,
-            'guidance_scale': guidance_scale
+            'guidance_scale': guidance_scale,
+            'engine': engine,
+            'prompt_embedding': pool_prompt_embeddings(hidden_states, inputs['attention_mask'])[0],
+            'shared_memory': shared_handle,
+            'transfers': transfers
         }
         
     except Exception as e:
         logger.error(f"Generation failed: {str(e)}")
         raise Exception(f"Music generation failed: {str(e)}")
 
+def generate_music_batch(prompts, runs, model_size='small', batch_size=4, engine=None, progress=None):
+    """
+    Generate many clips while text-encoding each unique prompt only once.
+    
+    Prompts are encoded up front, prompts of equal token length together.
+    Runs that share a prompt token length and sampling parameters (duration,
+    temperature, top_k, top_p and guidance scale; seeds may differ) are then
+    generated together in batches of `batch_size`, slicing the shared encoder
+    hidden states, so the encoder work is reused across every seed and
+    temperature. Prompts of different token lengths never share a batch.
+    
+    The audio of a (prompt, seed) grid point does not depend on which runs
+    share its batch or on `batch_size`: no row is ever padded (padding shifts
+    the encoder and cross-attention outputs slightly), and each clip samples
+    from its own generator seeded with its 'seed', so it matches a single
+    generation from that seed. The stock engine can only draw from the global
+    generator, so under it every clip is decoded in its own call.
+    
+    Args:
+        prompts (list): Unique text prompts
+        runs (list): Dicts with 'prompt_index' and 'params' holding 'duration',
+                     'temperature', 'guidance_scale', 'top_k', 'top_p' and 'seed'
+        model_size (str): Model size to use
+        batch_size (int): Maximum number of clips per generate call
+        engine (str): Decoding engine (default MUSICGEN_CONFIG['DECODING_ENGINE'])
+        progress (callable): Called with (clips generated, total clips) after
+                             each batch
+    
+    Returns:
+        list: One result dict per run, in the order of `runs`
+    """
+    
+    engine = engine or MUSICGEN_CONFIG['DECODING_ENGINE']
+    
+    try:
+        model, processor, device = load_musicgen_model(model_size)
+        
+        logger.info(f"Encoding {len(prompts)} unique prompts for {len(runs)} runs")
+        
+        inputs = processor(
+            text=list(prompts),
+            padding=True,
+            return_tensors="pt",
+        )
+        if device != "cpu":
+            inputs = inputs.to(device)
+        
+        # Encode each group of equal-length prompts without padding
+        lengths = inputs['attention_mask'].sum(dim=1).tolist()
+        encoded = {}
+        positions = [None] * len(prompts)
+        embeddings = [None] * len(prompts)
+        for length in sorted(set(lengths)):
+            members = [i for i, n in enumerate(lengths) if n == length]
+            group = {key: inputs[key][members, :length] for key in ('input_ids', 'attention_mask')}
+            group['hidden_states'] = encode_text_prompts(model, group)
+            encoded[length] = group
+            for position, (index, embedding) in enumerate(
+                    zip(members, pool_prompt_embeddings(group['hidden_states'], group['attention_mask']))):
+                positions[index] = position
+                embeddings[index] = embedding
+        sampling_rate = model.config.audio_encoder.sampling_rate
+        
+        # Group runs with the same prompt length and sampling parameters so they can share a
+        # batch; every row samples from its own seed, so seeds need not match
+        groups = {}
+        for index, run in enumerate(runs):
+            sampling = tuple(sorted((k, v) for k, v in run['params'].items() if k != 'seed'))
+            groups.setdefault((lengths[run['prompt_index']], sampling), []).append(index)
+        
+        if engine != 'static_cache':
+            batch_size = 1
+        
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+        os.makedirs('music', exist_ok=True)
+        results = [None] * len(runs)
+        completed = 0
+        
+        for (length, key), indices in groups.items():
+            params = dict(key)
+            group = encoded[length]
+            hidden_states = group['hidden_states']
+            for start in range(0, len(indices), batch_size):
+                chunk = indices[start:start + batch_size]
+                rows = torch.tensor([positions[runs[i]['prompt_index']] for i in chunk], device=hidden_states.device)
+                
+                logger.info(f"Generating batch of {len(chunk)} with {params}")
+                if engine == 'static_cache':
+                    generators = [torch.Generator(device=hidden_states.device)
+                                  .manual_seed(runs[i]['params']['seed']) for i in chunk]
+                else:
+                    torch.manual_seed(runs[chunk[0]]['params']['seed'])
+                    generators = None
+                audio_values = decode_audio(model, engine, group['input_ids'][rows], hidden_states[rows],
+                                            group['attention_mask'][rows], int(params['duration'] * 50),
+                                            params['guidance_scale'], params['temperature'],
+                                            params['top_k'], params['top_p'], generators=generators)
+                
+                for offset, index in enumerate(chunk):
+                    audio_array = audio_values[offset, 0].cpu().numpy()
+                    filename = f"sweep_{timestamp}_{index:04d}.wav"
+                    filepath = os.path.join('music', filename)
+                    scipy.io.wavfile.write(filepath, rate=sampling_rate, data=audio_array)
+                    
+                    results[index] = {
+                        'filename': filename,
+                        'filepath': filepath,
+                        'sample_rate': sampling_rate,
+                        'prompt': prompts[runs[index]['prompt_index']],
+                        'model_size': model_size,
+                        **runs[index]['params'],
+                        'prompt_embedding': embeddings[runs[index]['prompt_index']]
+                    }
+                
+                completed += len(chunk)
+                if progress is not None:
+                    progress(completed, len(runs))
+        
+        logger.info(f"Sweep generated {len(results)} clips")
+        return results
+        
+    except Exception as e:
+        logger.error(f"Batch generation failed: {str(e)}")
+        raise Exception(f"Batch music generation failed: {str(e)}")
+
 def generate_with_audio_prompt(audio_array, sampling_rate, text_prompt=None, 
                                duration=10, guidance_scale=3.0, model_size='small'):
     """
@@ -21,6 +21,9 @@ def main():
                        help=f'Sampling temperature (default: {MUSICGEN_CONFIG["DEFAULT_TEMPERATURE"]})')
     parser.add_argument('--guidance', type=float, default=MUSICGEN_CONFIG['DEFAULT_GUIDANCE_SCALE'],
                        help=f'Guidance scale (default: {MUSICGEN_CONFIG["DEFAULT_GUIDANCE_SCALE"]})')
+    parser.add_argument('--engine', type=str, default=MUSICGEN_CONFIG['DECODING_ENGINE'],
+                       choices=['static_cache', 'stock'],
+                       help=f'Decoding engine (default: {MUSICGEN_CONFIG["DECODING_ENGINE"]})')
     parser.add_argument('--list-models', action='store_true', help='List available models')
     
     args = parser.parse_args()
@@ -39,6 +42,7 @@ def main():
     print(f"   Model: {args.model}")
     print(f"   Temperature: {args.temperature}")
     print(f"   Guidance: {args.guidance}")
+    print(f"   Engine: {args.engine}")
     print()
     
     try:
@@ -47,7 +51,8 @@ def main():
             duration=args.duration,
             temperature=args.temperature,
             guidance_scale=args.guidance,
-            model_size=args.model
+            model_size=args.model,
+            engine=args.engine
         )
         
         print(f"✅ Success! Generated: {result['filename']}")
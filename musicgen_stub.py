@@ -0,0 +1,168 @@
+"""
+MusicGen Stub Module
+This module stands in for musicgen_api during load tests. It returns the same
+result dict as `generate_music_with_musicgen` after sleeping for a simulated
+inference time, and synthesises deterministic audio with numpy, so the web
+tier can be exercised without torch or a model.
+"""
+
+import os
+import json
+import time
+import zlib
+import itertools
+import threading
+import numpy as np
+import scipy
+from datetime import datetime
+import logging
+
+from audio_buffers import write_shared_audio
+from config import AUDIO_CONFIG, INFERENCE_CONFIG
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Width of the T5-base text encoder used by the small and medium models
+EMBEDDING_DIMENSION = 768
+
+_calls = itertools.count()
+_calls_lock = threading.Lock()
+
+def synthesize_clip(seed, duration, sample_rate=AUDIO_CONFIG['DEFAULT_SAMPLE_RATE']):
+    """
+    Render a short tone cluster that depends only on `seed`.
+
+    Args:
+        seed (int): Seed for the partials, envelope and noise
+        duration (float): Duration in seconds
+        sample_rate (int): Sampling rate in Hz
+
+    Returns:
+        np.ndarray: 1-D float32 audio samples in [-1, 1]
+    """
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(duration * sample_rate), dtype=np.float32) / sample_rate
+    audio = np.zeros_like(t)
+    for frequency in rng.uniform(110, 880, size=4):
+        audio += np.sin(2 * np.pi * frequency * t + rng.uniform(0, 2 * np.pi)).astype(np.float32)
+    audio *= np.exp(-t * rng.uniform(0.2, 1.0)).astype(np.float32)
+    audio += rng.normal(0, 0.01, size=t.size).astype(np.float32)
+    return (0.2 * audio).astype(np.float32)
+
+def _simulate_inference(duration, progress=None):
+    """Sleep for the simulated inference time, reporting progress about once per percent."""
+    max_new_tokens = int(duration * 50)
+    latency = INFERENCE_CONFIG['STUB_LATENCY'] * duration
+    ticks = max(1, min(max_new_tokens, 100))
+    for tick in range(1, ticks + 1):
+        time.sleep(latency / ticks)
+        if progress is not None:
+            progress(tick * max_new_tokens // ticks, max_new_tokens)
+
+def embed_prompts(prompts, model_size='small'):
+    """
+    Stub of `musicgen_api.embed_prompts`: a fixed random unit vector per prompt.
+
+    Returns:
+        np.ndarray: float32 array of shape (len(prompts), EMBEDDING_DIMENSION)
+    """
+    vectors = np.stack([
+        np.random.default_rng(zlib.crc32(prompt.encode('utf-8'))).standard_normal(EMBEDDING_DIMENSION)
+        for prompt in prompts
+    ]).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def generate_music_batch(prompts, runs, model_size='small', batch_size=4, engine=None, progress=None):
+    """
+    Stub of `musicgen_api.generate_music_batch` with the same arguments and
+    result keys. Audio is seeded by the prompt and sampling parameters, so a
+    grid point always produces the same clip.
+
+    Returns:
+        list: One result dict per run, in the order of `runs`
+    """
+    embeddings = embed_prompts(prompts, model_size)
+    sampling_rate = AUDIO_CONFIG['DEFAULT_SAMPLE_RATE']
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    os.makedirs('music', exist_ok=True)
+
+    logger.info(f"Stub generating {len(runs)} sweep clips")
+    results = []
+    for index, run in enumerate(runs):
+        params = run['params']
+        prompt = prompts[run['prompt_index']]
+        _simulate_inference(params['duration'])
+
+        key = json.dumps(params, sort_keys=True)
+        audio = synthesize_clip(zlib.crc32(f"{prompt}|{model_size}|{key}".encode('utf-8')), params['duration'],
+                                sampling_rate)
+        filename = f"sweep_{timestamp}_{index:04d}.wav"
+        filepath = os.path.join('music', filename)
+        scipy.io.wavfile.write(filepath, rate=sampling_rate, data=audio)
+
+        results.append({
+            'filename': filename,
+            'filepath': filepath,
+            'sample_rate': sampling_rate,
+            'prompt': prompt,
+            'model_size': model_size,
+            **params,
+            'prompt_embedding': embeddings[run['prompt_index']]
+        })
+        if progress is not None:
+            progress(index + 1, len(runs))
+    return results
+
+def generate_music_with_musicgen(prompt, duration=10, temperature=1.0, top_k=250, top_p=0.9,
+                                 guidance_scale=3.0, model_size='small', output='file', engine=None,
+                                 progress=None):
+    """
+    Stub of `musicgen_api.generate_music_with_musicgen` with the same arguments
+    and result keys.
+
+    Each call sleeps INFERENCE_CONFIG['STUB_LATENCY'] seconds per second of
+    audio, reporting progress along the way. The audio is seeded by the
+    request parameters and the call number within this process, so a given
+    sequence of requests reproduces the same clips while repeated prompts
+    still get distinct file hashes.
+
+    Returns:
+        dict: Contains 'filename', 'filepath', 'transfers' and generation metadata
+    """
+    with _calls_lock:
+        call = next(_calls)
+    sampling_rate = AUDIO_CONFIG['DEFAULT_SAMPLE_RATE']
+
+    logger.info(f"Stub generating music with prompt: '{prompt}'")
+    _simulate_inference(duration, progress)
+
+    seed = zlib.crc32(f"{prompt}|{duration}|{temperature}|{guidance_scale}|{model_size}|{call}".encode('utf-8'))
+    audio = synthesize_clip(seed, duration, sampling_rate)
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    filename = f"generated_{timestamp}_{call}.wav"
+    filepath = os.path.join('music', filename)
+
+    shared_handle = None
+    if output == 'shared_memory':
+        shared_handle, transfers = write_shared_audio(audio, sampling_rate)
+    else:
+        os.makedirs('music', exist_ok=True)
+        scipy.io.wavfile.write(filepath, rate=sampling_rate, data=audio)
+        transfers = [{'stage': 'write_file', 'bytes': os.path.getsize(filepath), 'copied': True}]
+
+    return {
+        'filename': filename,
+        'filepath': filepath,
+        'sample_rate': sampling_rate,
+        'duration': duration,
+        'prompt': prompt,
+        'model_size': model_size,
+        'temperature': temperature,
+        'guidance_scale': guidance_scale,
+        'engine': 'stub',
+        'prompt_embedding': None,
+        'shared_memory': shared_handle,
+        'transfers': transfers
+    }
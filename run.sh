@@ -1,5 +1,6 @@
 #!/bin/bash
-python app.py &
-echo "Flask app started on http://localhost:8080"
+gunicorn -c gunicorn.conf.py app:app &
+echo "Flask app started on http://localhost:8080 (gunicorn)"
 echo "PID: $!"
-echo "Application is running. Visit http://localhost:8080 in your browser."
\ No newline at end of file
+echo "Application is running. Visit http://localhost:8080 in your browser."
+echo "For the auto-reloading development server use: python app.py"
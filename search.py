@@ -0,0 +1,313 @@
+"""
+Prompt Search Module
+This module keeps a SQLite FTS5 full-text index over music file prompts and
+generation parameters, and an in-memory vector index of MusicGen text-encoder
+prompt embeddings for "similar prompts" lookups.
+"""
+
+import re
+import json
+import threading
+import logging
+import numpy as np
+from sqlalchemy import select, text
+
+from models import db, MusicFile, PromptEmbedding
+
+logger = logging.getLogger(__name__)
+
+FTS_TABLE = 'music_search'
+
+# External-content FTS5 table plus triggers that keep it in sync with music_files
+_FTS_SCHEMA = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        prompt, generation_params, content='music_files', content_rowid='id', prefix='2 3 4'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON music_files BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, prompt, generation_params)
+        VALUES (new.id, new.prompt, new.generation_params);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON music_files BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, prompt, generation_params)
+        VALUES ('delete', old.id, old.prompt, old.generation_params);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON music_files BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, prompt, generation_params)
+        VALUES ('delete', old.id, old.prompt, old.generation_params);
+        INSERT INTO {FTS_TABLE}(rowid, prompt, generation_params)
+        VALUES (new.id, new.prompt, new.generation_params);
+    END"""
+]
+
+_fts_ready = None
+_fts_lock = threading.Lock()
+
+def init_search_index():
+    """
+    Create the full-text index and its sync triggers if they do not exist yet.
+
+    A freshly created index is backfilled from music_files. Databases without
+    FTS5 support fall back to LIKE matching in `search_prompts`.
+
+    Returns:
+        bool: True if the FTS5 index is available
+    """
+    global _fts_ready
+    with _fts_lock:
+        if _fts_ready is not None:
+            return _fts_ready
+        if db.engine.dialect.name != 'sqlite':
+            _fts_ready = False
+            return _fts_ready
+        try:
+            exists = db.session.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE}
+            ).first() is not None
+            for statement in _FTS_SCHEMA:
+                db.session.execute(text(statement))
+            if not exists:
+                db.session.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+            db.session.commit()
+            _fts_ready = True
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"FTS5 index unavailable, falling back to LIKE search: {str(e)}")
+            _fts_ready = False
+        return _fts_ready
+
+def _fts_query(query):
+    """
+    Turn free text into a safe FTS5 query.
+
+    Every word is quoted; only the last one is a prefix term, since that is
+    the word still being typed. Prefixes shorter than three characters match
+    most of the library, so they are treated as whole words.
+    """
+    words = re.findall(r'\w+', query)
+    tokens = [f'"{word}"' for word in words]
+    if words and len(words[-1]) >= 3:
+        tokens[-1] += '*'
+    return ' '.join(tokens)
+
+def _music_summary(music_file, score=None):
+    return {
+        'id': music_file.id,
+        'filename': music_file.filename,
+        'prompt': music_file.prompt,
+        'generation_params': json.loads(music_file.generation_params) if music_file.generation_params else None,
+        'created_at': music_file.created_at.isoformat(),
+        'score': score
+    }
+
+def search_prompts(query, limit=10):
+    """
+    Full-text search over prompts and generation parameters.
+
+    Args:
+        query (str): Free-text query; the last word is matched as a prefix
+        limit (int): Maximum number of results
+
+    Returns:
+        list: Matching music files, best match first
+    """
+    match = _fts_query(query)
+    if not match:
+        return []
+
+    if init_search_index():
+        rows = db.session.execute(
+            text(f"SELECT rowid, rank FROM {FTS_TABLE} "
+                 f"WHERE {FTS_TABLE} MATCH :match ORDER BY rank LIMIT :limit"),
+            {'match': match, 'limit': limit}
+        ).all()
+        music_files = {m.id: m for m in MusicFile.query.filter(MusicFile.id.in_([r.rowid for r in rows]))}
+        return [_music_summary(music_files[r.rowid], -r.rank) for r in rows if r.rowid in music_files]
+
+    matches = MusicFile.query
+    for word in re.findall(r'\w+', query):
+        matches = matches.filter(MusicFile.prompt.ilike(f'%{word}%'))
+    return [_music_summary(m) for m in matches.order_by(MusicFile.created_at.desc()).limit(limit)]
+
+def add_prompt_embedding(music_id, vector):
+    """
+    Store the prompt embedding of a music file. The caller commits the session.
+
+    Args:
+        music_id (int): Music file id
+        vector (np.ndarray): 1-D prompt embedding
+    """
+    vector = np.asarray(vector, dtype=np.float32)
+    db.session.add(PromptEmbedding(music_id=music_id, dimension=vector.size, vector=vector.tobytes()))
+
+class PromptVectorIndex:
+    """
+    Cosine-similarity index over stored prompt embeddings.
+
+    Embeddings are L2-normalised into one contiguous float32 matrix that grows
+    incrementally. Scoring all of it takes about 30 ms per lookup at 100k
+    768-d prompts, so once the index is large enough, candidates are first
+    shortlisted on a PCA projection fitted to the stored embeddings, and only
+    the shortlist is scored exactly.
+
+    Mean-pooled text-encoder embeddings share a large common component, which
+    a projection would mostly discard. With m the index mean, the score of a
+    row x splits into x.q = (x - m).(q - m) + (x - m).m + m.q. The last term
+    is the same for every row and the middle one is stored exactly per row,
+    so only the centred product is approximated by the projection.
+    """
+
+    PROJECTED_DIMENSION = 128
+    SHORTLIST_SIZE = 1000
+    # Smaller indexes are scored exactly on every lookup
+    MIN_PROJECTED_SIZE = 10000
+    # Rows sampled to fit the projection, refitted whenever the index doubles
+    FIT_SAMPLE_SIZE = 8192
+
+    def __init__(self):
+        self.last_music_id = 0
+        self.dimension = None
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._music_ids = np.empty(0, dtype=np.int64)
+        self._size = 0
+        self._mean = None
+        self._basis = None
+        self._projected = np.empty((0, 0), dtype=np.float32)
+        self._offsets = np.empty(0, dtype=np.float32)
+        self._fitted_size = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._size
+
+    def refresh(self):
+        """Load embeddings stored since the last refresh."""
+        with self._lock:
+            rows = db.session.execute(
+                select(PromptEmbedding.music_id, PromptEmbedding.dimension, PromptEmbedding.vector)
+                .where(PromptEmbedding.music_id > self.last_music_id)
+                .order_by(PromptEmbedding.music_id)
+            ).all()
+            if not rows:
+                return
+            if self.dimension is None:
+                self._initialise(rows[0].dimension)
+
+            self.last_music_id = rows[-1].music_id
+
+            # Embeddings from a text encoder with a different width cannot share the index
+            rows = [r for r in rows if r.dimension == self.dimension]
+            vectors = np.frombuffer(b''.join(r.vector for r in rows), dtype=np.float32).reshape(-1, self.dimension)
+            self._append(np.array([r.music_id for r in rows], dtype=np.int64), _normalise(vectors))
+            if (self._size >= max(self.MIN_PROJECTED_SIZE, 2 * self._fitted_size)
+                    and self.dimension > self.PROJECTED_DIMENSION):
+                self._fit()
+
+    def _initialise(self, dimension):
+        self.dimension = dimension
+        self._matrix = np.empty((1024, dimension), dtype=np.float32)
+        self._music_ids = np.empty(1024, dtype=np.int64)
+
+    def _append(self, music_ids, vectors):
+        needed = self._size + len(music_ids)
+        if needed > len(self._music_ids):
+            capacity = max(needed, 2 * len(self._music_ids))
+            self._matrix = _grow(self._matrix, self._size, capacity)
+            self._music_ids = _grow(self._music_ids, self._size, capacity)
+            if self._basis is not None:
+                self._projected = _grow(self._projected, self._size, capacity)
+                self._offsets = _grow(self._offsets, self._size, capacity)
+        self._matrix[self._size:needed] = vectors
+        self._music_ids[self._size:needed] = music_ids
+        if self._basis is not None:
+            self._project(self._size, needed)
+        self._size = needed
+
+    def _fit(self):
+        """Fit the centred PCA projection to the stored embeddings and project every row."""
+        rows = self._matrix[:self._size]
+        sample = rows[np.random.default_rng(0).choice(self._size, min(self._size, self.FIT_SAMPLE_SIZE),
+                                                      replace=False)]
+        self._mean = rows.mean(axis=0)
+        centred = sample - self._mean
+        _, eigenvectors = np.linalg.eigh(centred.T @ centred)
+        self._basis = np.ascontiguousarray(eigenvectors[:, ::-1][:, :self.PROJECTED_DIMENSION], dtype=np.float32)
+        self._projected = np.empty((len(self._music_ids), self.PROJECTED_DIMENSION), dtype=np.float32)
+        self._offsets = np.empty(len(self._music_ids), dtype=np.float32)
+        self._project(0, self._size)
+        self._fitted_size = self._size
+
+    def _project(self, start, stop, chunk_size=16384):
+        for begin in range(start, stop, chunk_size):
+            end = min(begin + chunk_size, stop)
+            centred = self._matrix[begin:end] - self._mean
+            self._projected[begin:end] = centred @ self._basis
+            self._offsets[begin:end] = centred @ self._mean
+
+    def vector_for(self, music_id):
+        """Return the normalised embedding of a music file, or None."""
+        self.refresh()
+        with self._lock:
+            position = np.flatnonzero(self._music_ids[:self._size] == music_id)
+            return self._matrix[position[0]].copy() if position.size else None
+
+    def nearest(self, vector, limit=10, exclude=None):
+        """
+        Find the music files whose prompts are closest to an embedding.
+
+        Args:
+            vector (np.ndarray): Query embedding
+            limit (int): Maximum number of results
+            exclude (int): Music file id to leave out (e.g. the query clip itself)
+
+        Returns:
+            list: (music_id, cosine similarity) pairs, most similar first
+        """
+        self.refresh()
+        with self._lock:
+            if self._size == 0 or np.asarray(vector).size != self.dimension:
+                return []
+            query = _normalise(np.asarray(vector, dtype=np.float32).reshape(1, -1))[0]
+            shortlist = max(self.SHORTLIST_SIZE, limit + 1)
+
+            if self._basis is not None and shortlist < self._size:
+                # Shortlist on the projection, then score the shortlist exactly
+                coarse = self._projected[:self._size] @ ((query - self._mean) @ self._basis)
+                coarse += self._offsets[:self._size]
+                shortlisted = np.argpartition(-coarse, shortlist - 1)[:shortlist]
+                music_ids = self._music_ids[shortlisted]
+                scores = self._matrix[shortlisted] @ query
+            else:
+                music_ids = self._music_ids[:self._size]
+                scores = self._matrix[:self._size] @ query
+            if exclude is not None:
+                scores[music_ids == exclude] = -np.inf
+
+            # Partial sort: only the top `limit` scores are ordered
+            top = min(scores.size, max(limit, 1))
+            candidates = np.argpartition(-scores, top - 1)[:top]
+            order = candidates[np.argsort(-scores[candidates])][:limit]
+            return [(int(music_ids[i]), float(scores[i])) for i in order if np.isfinite(scores[i])]
+
+def _grow(array, size, capacity):
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:size] = array[:size]
+    return grown
+
+def _normalise(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+def similar_music(vector, limit=10, exclude=None):
+    """
+    Music files with the most similar prompt embeddings.
+
+    Returns:
+        list: Music file summaries with cosine similarity scores
+    """
+    matches = prompt_index.nearest(vector, limit=limit, exclude=exclude)
+    music_files = {m.id: m for m in MusicFile.query.filter(MusicFile.id.in_([m for m, _ in matches]))}
+    return [_music_summary(music_files[m], score) for m, score in matches if m in music_files]
+
+# Shared instance used by the web application
+prompt_index = PromptVectorIndex()
@@ -28,16 +28,101 @@ function showToast(message, type = 'success') {
 async function scanMusicFolder() {
     try {
         const response = await axios.get('/api/music/scan');
+        // Added files reach open pages as music_created events
         showToast(response.data.message, 'success');
-        if (window.loadMusicList) {
-            window.loadMusicList();
-        }
     } catch (error) {
         showToast('Failed to scan music folder', 'danger');
         console.error('Scan error:', error);
     }
 }
 
+// Subscribe to live library updates pushed over server-sent events, then
+// load the page's view with load() once the stream is connected.
+// handlers maps event types (music_created, evaluation_created, aggregates)
+// to callbacks receiving the parsed payload. Events that arrive while load()
+// runs are held back and applied after it resolves, so nothing committed
+// around the initial fetch is lost; handlers must tolerate events the loaded
+// view already reflects. A resync means events were missed and reloads the
+// view the same way.
+function subscribeToEvents(handlers, load) {
+    let held = null;
+    let stale = false;
+    const reload = async () => {
+        if (held) {
+            stale = true;
+            return;
+        }
+        held = [];
+        try {
+            await load();
+        } finally {
+            const events = held;
+            held = null;
+            events.forEach(([type, data]) => handlers[type] && handlers[type](data));
+        }
+        if (stale) {
+            stale = false;
+            reload();
+        }
+    };
+    
+    if (!window.EventSource) {
+        reload();
+        return null;
+    }
+    
+    const source = new EventSource('/api/events');
+    let connected = false;
+    const start = () => {
+        if (!connected) {
+            connected = true;
+            reload();
+        }
+    };
+    source.addEventListener('open', start);
+    source.addEventListener('error', start);
+    source.addEventListener('resync', reload);
+    ['music_created', 'evaluation_created', 'aggregates'].forEach(type => {
+        source.addEventListener(type, (event) => {
+            const data = JSON.parse(event.data);
+            if (held) {
+                held.push([type, data]);
+            } else if (handlers[type]) {
+                handlers[type](data);
+            }
+        });
+    });
+    return source;
+}
+
+// Follow the progress of one generation job on its own event stream.
+// Resolves with the EventSource once it is connected (or has failed to),
+// so the job can be started without missing its first updates; close the
+// source when the job has finished.
+function subscribeToJob(jobId, onProgress) {
+    if (!window.EventSource) {
+        return Promise.resolve(null);
+    }
+    
+    const source = new EventSource(`/api/events?job_id=${encodeURIComponent(jobId)}`);
+    source.addEventListener('generation_progress', (event) => onProgress(JSON.parse(event.data)));
+    return new Promise(resolve => {
+        source.addEventListener('open', () => resolve(source), { once: true });
+        source.addEventListener('error', () => resolve(source), { once: true });
+    });
+}
+
+// Insert or replace an item in a list of objects with ids; returns true if it was new
+function upsertById(items, item) {
+    const index = items.findIndex(existing => existing.id === item.id);
+    if (index === -1) {
+        items.unshift(item);
+        return true;
+    }
+    items[index] = item;
+    return false;
+}
+
 // Export evaluation data
 async function exportData() {
     try {
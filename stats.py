@@ -0,0 +1,488 @@
+"""
+Inter-rater Statistics Module
+This module computes leaderboards, reliability coefficients and rater-bias
+corrected scores over a columnar NumPy snapshot of the evaluations table.
+"""
+
+import json
+import threading
+import numpy as np
+from sqlalchemy import select
+
+from config import EVALUATION_CONFIG, PROMPT_TEMPLATES
+from models import db, MusicFile, Evaluation
+
+# Rating columns analysed by the engine (the weighted criteria plus the overall rating)
+CRITERIA = [c['id'] for c in EVALUATION_CONFIG['CRITERIA']] + ['overall_rating']
+
+# Supported leaderboard groupings
+GROUP_BY = ('model_size', 'category')
+
+UNKNOWN_GROUP = 'unknown'
+
+# Evaluation rows converted to columns per batch when loading the snapshot
+LOAD_BATCH_SIZE = 100000
+
+def _prompt_category(prompt, generation_params):
+    """
+    Work out the prompt category of a music file.
+
+    An explicit 'category' in the generation parameters wins; otherwise the
+    prompt is matched against the category names of PROMPT_TEMPLATES.
+    """
+    if generation_params.get('category'):
+        return generation_params['category']
+    text = (prompt or '').lower()
+    for category in PROMPT_TEMPLATES:
+        if category in text:
+            return category
+    return UNKNOWN_GROUP
+
+def _parse_params(raw):
+    """Decode a generation_params JSON string, tolerating missing or bad data."""
+    if not raw:
+        return {}
+    try:
+        params = json.loads(raw)
+    except (TypeError, ValueError):
+        return {}
+    return params if isinstance(params, dict) else {}
+
+def krippendorff_alpha(values, units):
+    """
+    Krippendorff's alpha for interval data.
+
+    Args:
+        values (np.ndarray): Ratings (NaN for missing)
+        units (np.ndarray): Integer unit (music file) index of each rating
+
+    Returns:
+        float or None: Alpha, or None when fewer than two pairable values exist
+    """
+    mask = ~np.isnan(values)
+    values, units = values[mask], units[mask]
+    if values.size == 0:
+        return None
+
+    counts = np.bincount(units)
+    sums = np.bincount(units, weights=values)
+    squares = np.bincount(units, weights=values * values)
+
+    # Only units rated at least twice are pairable
+    pairable = counts >= 2
+    m = counts[pairable]
+    n = m.sum()
+    if n < 2:
+        return None
+
+    # Sum of squared differences over ordered pairs within each unit
+    within = 2 * (m * squares[pairable] - sums[pairable] ** 2)
+    observed = np.sum(within / (m - 1)) / n
+
+    total = sums[pairable].sum()
+    total_sq = squares[pairable].sum()
+    expected = 2 * (n * total_sq - total ** 2) / (n * (n - 1))
+    if expected == 0:
+        return None
+    return float(1 - observed / expected)
+
+def icc_oneway(values, units):
+    """
+    One-way random-effects intraclass correlation ICC(1) for unbalanced designs.
+
+    Args:
+        values (np.ndarray): Ratings (NaN for missing)
+        units (np.ndarray): Integer unit (music file) index of each rating
+
+    Returns:
+        float or None: ICC(1), or None when it is undefined
+    """
+    mask = ~np.isnan(values)
+    values, units = values[mask], units[mask]
+    if values.size == 0:
+        return None
+
+    counts = np.bincount(units)
+    sums = np.bincount(units, weights=values)
+    rated = counts > 0
+    k = counts[rated]
+    groups = k.size
+    total = k.sum()
+    if groups < 2 or total <= groups:
+        return None
+
+    means = sums[rated] / k
+    grand_mean = values.mean()
+    ss_between = np.sum(k * (means - grand_mean) ** 2)
+    ss_within = np.sum((values - means[np.cumsum(rated)[units] - 1]) ** 2)
+
+    ms_between = ss_between / (groups - 1)
+    ms_within = ss_within / (total - groups)
+    k0 = (total - np.sum(k * k) / total) / (groups - 1)
+    denominator = ms_between + (k0 - 1) * ms_within
+    if denominator == 0:
+        return None
+    return float((ms_between - ms_within) / denominator)
+
+def zscore_by_rater(values, raters):
+    """
+    Remove per-evaluator bias by z-scoring each rating within its evaluator.
+
+    Evaluators with a single rating or no spread are centred but not scaled.
+
+    Args:
+        values (np.ndarray): Ratings (NaN for missing)
+        raters (np.ndarray): Integer evaluator index of each rating
+
+    Returns:
+        np.ndarray: Corrected ratings, NaN where the input was missing
+    """
+    mask = ~np.isnan(values)
+    filled = np.where(mask, values, 0.0)
+    minlength = int(raters.max()) + 1 if raters.size else 0
+    counts = np.bincount(raters, weights=mask, minlength=minlength)
+    sums = np.bincount(raters, weights=filled, minlength=minlength)
+    squares = np.bincount(raters, weights=filled * filled, minlength=minlength)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        means = sums / counts
+        stds = np.sqrt(np.maximum(squares / counts - means ** 2, 0.0))
+    stds = np.where(stds > 0, stds, 1.0)
+
+    corrected = (values - means[raters]) / stds[raters]
+    corrected[~mask] = np.nan
+    return corrected
+
+def bootstrap_mean_ci(distinct, counts, n_resamples=1000, confidence=0.95, rng=None):
+    """
+    Percentile bootstrap confidence interval for the mean of a rating histogram.
+
+    Ratings take few distinct values, so resampling is done over the counts of
+    each distinct value with a multinomial draw. This is exactly equivalent to
+    resampling individual ratings but costs O(resamples x distinct values)
+    instead of O(resamples x ratings).
+
+    Args:
+        distinct (np.ndarray): Distinct rating values
+        counts (np.ndarray): Number of ratings with each value
+        n_resamples (int): Number of bootstrap resamples
+        confidence (float): Confidence level of the interval
+        rng (np.random.Generator): Random generator to draw from
+
+    Returns:
+        tuple: (lower, upper) bounds
+    """
+    rng = rng or np.random.default_rng()
+    n = counts.sum()
+    draws = rng.multinomial(n, counts / n, size=n_resamples)
+    means = draws @ distinct / n
+    alpha = (1 - confidence) / 2
+    lower, upper = np.quantile(means, [alpha, 1 - alpha])
+    return float(lower), float(upper)
+
+def _rating_column(values):
+    """Ratings as float64, with missing (None or blank) ratings as NaN."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        values = np.array(values, dtype=object)
+        values[values == ''] = None
+        return values.astype(np.float64)
+
+class _Column:
+    """Growable NumPy column with amortised O(1) appends."""
+
+    def __init__(self, dtype):
+        self._data = np.empty(1024, dtype=dtype)
+        self._size = 0
+
+    def extend(self, values):
+        values = np.asarray(values, dtype=self._data.dtype)
+        needed = self._size + values.size
+        if needed > self._data.size:
+            grown = np.empty(max(needed, 2 * self._data.size), dtype=self._data.dtype)
+            grown[:self._size] = self._data[:self._size]
+            self._data = grown
+        self._data[self._size:needed] = values
+        self._size = needed
+
+    def resize(self, size, fill=0):
+        """Grow the column to at least `size` entries, padding with `fill`."""
+        if size > self._size:
+            self.extend(np.full(size - self._size, fill, dtype=self._data.dtype))
+
+    def __setitem__(self, index, value):
+        self._data[:self._size][index] = value
+
+    @property
+    def values(self):
+        return self._data[:self._size]
+
+class RatingSnapshot:
+    """
+    Columnar, append-only copy of the evaluations table.
+
+    Rows are pulled with plain column selects rather than ORM objects, and
+    each refresh only fetches rows newer than the last one seen.
+    """
+
+    def __init__(self):
+        self.last_evaluation_id = 0
+        self.last_music_id = 0
+        self._music_ids = _Column(np.int64)
+        self._evaluator_ids = _Column(np.int64)
+        self._ratings = {criterion: _Column(np.float64) for criterion in CRITERIA}
+
+        # Per music file group codes, indexed by music file id
+        self._music_groups = {group: _Column(np.int64) for group in GROUP_BY}
+        self.group_labels = {group: [UNKNOWN_GROUP] for group in GROUP_BY}
+        self._group_codes = {group: {UNKNOWN_GROUP: 0} for group in GROUP_BY}
+        self.evaluator_names = []
+        self._evaluator_codes = {}
+
+    def __len__(self):
+        return self._music_ids.values.size
+
+    @property
+    def music_ids(self):
+        return self._music_ids.values
+
+    @property
+    def evaluator_ids(self):
+        return self._evaluator_ids.values
+
+    def ratings(self, criterion):
+        return self._ratings[criterion].values
+
+    def music_groups(self, group_by):
+        return self._music_groups[group_by].values
+
+    def refresh(self):
+        """
+        Append rows inserted since the last refresh.
+
+        Returns:
+            bool: True if any new rows were loaded
+        """
+        new_music = self._load_music_files()
+        new_ratings = self._load_evaluations()
+        return new_music or new_ratings
+
+    def _load_music_files(self):
+        rows = db.session.execute(
+            select(MusicFile.id, MusicFile.prompt, MusicFile.generation_params)
+            .where(MusicFile.id > self.last_music_id)
+            .order_by(MusicFile.id)
+        ).all()
+        if not rows:
+            return False
+
+        for group in GROUP_BY:
+            self._music_groups[group].resize(rows[-1].id + 1)
+
+        for row in rows:
+            params = _parse_params(row.generation_params)
+            labels = {
+                'model_size': params.get('model_size') or UNKNOWN_GROUP,
+                'category': _prompt_category(row.prompt, params)
+            }
+            for group, label in labels.items():
+                self._music_groups[group][row.id] = self._code(self._group_codes[group], self.group_labels[group], label)
+
+        self.last_music_id = rows[-1].id
+        return True
+
+    def _load_evaluations(self):
+        columns = [getattr(Evaluation, criterion) for criterion in CRITERIA]
+        # A Core select on the session's connection skips ORM row processing
+        result = db.session.connection().execute(
+            select(Evaluation.id, Evaluation.music_id, Evaluation.evaluator_name, *columns)
+            .where(Evaluation.id > self.last_evaluation_id)
+            .order_by(Evaluation.id)
+        )
+        loaded = False
+        while rows := result.fetchmany(LOAD_BATCH_SIZE):
+            self._append_evaluations(rows)
+            loaded = True
+        return loaded
+
+    def _append_evaluations(self, rows):
+        """Append one batch of evaluation rows, converting whole columns at a time."""
+        ids, music_ids, evaluators, *ratings = zip(*rows)
+        music_ids = np.array(music_ids, dtype=np.int64)
+        self._music_ids.extend(music_ids)
+
+        # Code each distinct evaluator once rather than every row
+        names = np.array(evaluators, dtype=object)
+        names[np.equal(names, None) | np.equal(names, '')] = 'Anonymous'
+        distinct, inverse = np.unique(names.astype(str), return_inverse=True)
+        codes = np.array([self._code(self._evaluator_codes, self.evaluator_names, name) for name in distinct],
+                         dtype=np.int64)
+        self._evaluator_ids.extend(codes[inverse.reshape(-1)])
+
+        for criterion, column in zip(CRITERIA, ratings):
+            self._ratings[criterion].extend(_rating_column(column))
+
+        # A rating can reference a music file inserted after the music files were read
+        for group in GROUP_BY:
+            self._music_groups[group].resize(int(music_ids.max()) + 1)
+
+        self.last_evaluation_id = ids[-1]
+
+    @staticmethod
+    def _code(codes, labels, label):
+        if label not in codes:
+            codes[label] = len(labels)
+            labels.append(label)
+        return codes[label]
+
+class RatingStats:
+    """
+    Cached statistics over a RatingSnapshot.
+
+    Results are memoised per query and dropped whenever a refresh appends new
+    ratings, so repeated dashboard requests cost one indexed select each.
+    """
+
+    def __init__(self, n_resamples=1000, confidence=0.95, seed=0):
+        self.n_resamples = n_resamples
+        self.confidence = confidence
+        self.seed = seed
+        self.snapshot = RatingSnapshot()
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """Pull new rows and invalidate cached results if anything changed."""
+        with self._lock:
+            if self.snapshot.refresh():
+                self._cache.clear()
+
+    def reset(self):
+        """Drop the snapshot and all cached results."""
+        with self._lock:
+            self.snapshot = RatingSnapshot()
+            self._cache.clear()
+
+    def _cached(self, key, compute):
+        self.refresh()
+        with self._lock:
+            if key not in self._cache:
+                self._cache[key] = compute()
+            return self._cache[key]
+
+    def _values(self, criterion, corrected):
+        values = self.snapshot.ratings(criterion)
+        if corrected:
+            values = zscore_by_rater(values, self.snapshot.evaluator_ids)
+        return values
+
+    def leaderboard(self, group_by='model_size', criterion='overall_rating', corrected=False):
+        """
+        Rank groups of music files by mean rating with bootstrap confidence intervals.
+
+        Args:
+            group_by (str): 'model_size' or 'category'
+            criterion (str): Rating column to rank by
+            corrected (bool): Use per-evaluator z-scored ratings
+
+        Returns:
+            list: One dict per group, best first
+        """
+        if group_by not in GROUP_BY:
+            raise ValueError(f"Unknown grouping: {group_by}")
+        if criterion not in CRITERIA:
+            raise ValueError(f"Unknown criterion: {criterion}")
+        return self._cached(('leaderboard', group_by, criterion, corrected),
+                            lambda: self._leaderboard(group_by, criterion, corrected))
+
+    def _leaderboard(self, group_by, criterion, corrected):
+        snapshot = self.snapshot
+        values = self._values(criterion, corrected)
+        mask = ~np.isnan(values)
+        values, music_ids = values[mask], snapshot.music_ids[mask]
+        if values.size == 0:
+            return []
+
+        music_groups = snapshot.music_groups(group_by)
+        groups = music_groups[music_ids]
+        n_groups = len(snapshot.group_labels[group_by])
+
+        # Histogram of distinct rating values per group: the bootstrap only needs these counts
+        distinct, codes = np.unique(values, return_inverse=True)
+        histogram = np.bincount(groups * distinct.size + codes,
+                                minlength=n_groups * distinct.size).reshape(n_groups, distinct.size)
+        rated_music = np.flatnonzero(np.bincount(music_ids))
+        music_counts = np.bincount(music_groups[rated_music], minlength=n_groups)
+
+        rng = np.random.default_rng(self.seed)
+        board = []
+        for code in np.flatnonzero(histogram.sum(axis=1)):
+            counts = histogram[code]
+            n = counts.sum()
+            lower, upper = bootstrap_mean_ci(distinct, counts, self.n_resamples, self.confidence, rng)
+            board.append({
+                'group': snapshot.group_labels[group_by][code],
+                'mean': float(counts @ distinct / n),
+                'ci_lower': lower,
+                'ci_upper': upper,
+                'ratings': int(n),
+                'music_files': int(music_counts[code])
+            })
+        board.sort(key=lambda entry: entry['mean'], reverse=True)
+        return board
+
+    def reliability(self, corrected=False):
+        """
+        Inter-rater reliability of every criterion.
+
+        Args:
+            corrected (bool): Use per-evaluator z-scored ratings
+
+        Returns:
+            dict: Criterion id mapped to its alpha, ICC(1) and rating count
+        """
+        return self._cached(('reliability', corrected), lambda: self._reliability(corrected))
+
+    def _reliability(self, corrected):
+        units = self.snapshot.music_ids
+        result = {}
+        for criterion in CRITERIA:
+            values = self._values(criterion, corrected)
+            result[criterion] = {
+                'krippendorff_alpha': krippendorff_alpha(values, units),
+                'icc1': icc_oneway(values, units),
+                'ratings': int(np.count_nonzero(~np.isnan(values)))
+            }
+        return result
+
+    def music_scores(self, criterion='overall_rating', corrected=True):
+        """
+        Mean rating of every music file, optionally bias corrected.
+
+        Args:
+            criterion (str): Rating column to average
+            corrected (bool): Use per-evaluator z-scored ratings
+
+        Returns:
+            dict: Music file id mapped to its mean score and rating count
+        """
+        if criterion not in CRITERIA:
+            raise ValueError(f"Unknown criterion: {criterion}")
+        return self._cached(('music_scores', criterion, corrected),
+                            lambda: self._music_scores(criterion, corrected))
+
+    def _music_scores(self, criterion, corrected):
+        values = self._values(criterion, corrected)
+        mask = ~np.isnan(values)
+        units = self.snapshot.music_ids[mask]
+        counts = np.bincount(units)
+        sums = np.bincount(units, weights=values[mask])
+        rated = np.flatnonzero(counts)
+        return {
+            int(music_id): {'mean': float(sums[music_id] / counts[music_id]), 'ratings': int(counts[music_id])}
+            for music_id in rated
+        }
+
+# Shared instance used by the web application
+rating_stats = RatingStats()
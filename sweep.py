@@ -0,0 +1,195 @@
+"""
+Prompt Sweep Module
+This module expands PROMPT_TEMPLATES over placeholder values and sampling
+parameter grids into a deduplicated job set for batched generation, and
+builds sweep reports that link each generated file to its grid coordinates.
+"""
+
+import json
+import math
+import string
+import itertools
+
+from config import PROMPT_TEMPLATES, MUSICGEN_CONFIG, SWEEP_CONFIG
+from models import Sweep
+
+# Sampling parameters that can be swept, with the value used when a grid omits them
+GRID_PARAMETERS = {
+    'duration': MUSICGEN_CONFIG['DEFAULT_DURATION'],
+    'temperature': MUSICGEN_CONFIG['DEFAULT_TEMPERATURE'],
+    'guidance_scale': MUSICGEN_CONFIG['DEFAULT_GUIDANCE_SCALE'],
+    'top_k': MUSICGEN_CONFIG['DEFAULT_TOP_K'],
+    'top_p': MUSICGEN_CONFIG['DEFAULT_TOP_P'],
+    'seed': 0
+}
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# Check applied to every value of a grid axis, and what the values must be
+GRID_CHECKS = {
+    'duration': (lambda v: _is_number(v) and 0 < v <= MUSICGEN_CONFIG['MAX_DURATION'],
+                 f"numbers of seconds in (0, {MUSICGEN_CONFIG['MAX_DURATION']}]"),
+    'temperature': (lambda v: _is_number(v) and v > 0, "numbers greater than 0"),
+    'guidance_scale': (_is_number, "numbers"),
+    'top_k': (lambda v: _is_integer(v) and v >= 0, "integers of at least 0"),
+    'top_p': (lambda v: _is_number(v) and 0 < v <= 1, "numbers in (0, 1]"),
+    'seed': (lambda v: _is_integer(v) and 0 <= v < 2 ** 64, "non-negative 64-bit integers")
+}
+
+def template_placeholders(template):
+    """Return the placeholder names of a template, in order of first use."""
+    names = [field for _, field, _, _ in string.Formatter().parse(template) if field]
+    return list(dict.fromkeys(names))
+
+def expand_templates(templates, values):
+    """
+    Expand templates over the cartesian product of their placeholder values.
+
+    Args:
+        templates (list): (category, template) pairs
+        values (dict): Placeholder name mapped to a list of values
+
+    Returns:
+        tuple: (entries, skipped) where entries hold the category, template,
+               bindings and rendered prompt, and skipped lists templates with
+               placeholders that have no values
+    """
+    entries = []
+    skipped = []
+    for category, template in templates:
+        names = template_placeholders(template)
+        missing = [name for name in names if not values.get(name)]
+        if missing:
+            skipped.append({'category': category, 'template': template, 'missing': missing})
+            continue
+
+        for combination in itertools.product(*(_as_list(values[name]) for name in names)):
+            bindings = dict(zip(names, combination))
+            entries.append({
+                'category': category,
+                'template': template,
+                'bindings': bindings,
+                'prompt': template.format(**bindings)
+            })
+    return entries, skipped
+
+def parameter_grid(grid):
+    """
+    Expand a sampling parameter grid into its points.
+
+    Args:
+        grid (dict): Parameter name mapped to a value or list of values
+
+    Returns:
+        list: One dict of sampling parameters per grid point
+
+    Raises:
+        ValueError: If a parameter is unknown or has a value of the wrong type or range
+    """
+    if not isinstance(grid, dict):
+        raise ValueError("Sweep grid must map parameter names to values")
+    unknown = set(grid) - set(GRID_PARAMETERS)
+    if unknown:
+        raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+
+    axes = {name: _as_list(grid.get(name, default)) for name, default in GRID_PARAMETERS.items()}
+    for name, values in axes.items():
+        check, expected = GRID_CHECKS[name]
+        invalid = [value for value in values if not check(value)]
+        if invalid:
+            raise ValueError(f"Sweep parameter '{name}' must be {expected}; got {json.dumps(invalid[0])}")
+    return [dict(zip(axes, point)) for point in itertools.product(*axes.values())]
+
+def _as_list(value):
+    return list(value) if isinstance(value, (list, tuple)) else [value]
+
+def _selected_templates(spec):
+    """Resolve the (category, template) pairs a sweep spec asks for."""
+    if spec.get('templates'):
+        return [('custom', template) for template in spec['templates']]
+
+    categories = spec.get('categories') or list(PROMPT_TEMPLATES)
+    unknown = [c for c in categories if c not in PROMPT_TEMPLATES]
+    if unknown:
+        raise ValueError(f"Unknown template categories: {', '.join(unknown)}")
+    return [(category, template) for category in categories for template in PROMPT_TEMPLATES[category]]
+
+def plan_sweep(spec):
+    """
+    Turn a sweep spec into a deduplicated job set.
+
+    Identical rendered prompts are merged so each is text-encoded once; every
+    job records all template coordinates that produced its prompt.
+
+    Args:
+        spec (dict): 'templates' (list of template strings) or 'categories'
+                     (PROMPT_TEMPLATES keys, default all), 'values'
+                     (placeholder values) and 'grid' (sampling parameters)
+
+    Returns:
+        dict: 'prompts' (unique prompts), 'jobs' and 'skipped' templates
+    """
+    entries, skipped = expand_templates(_selected_templates(spec), spec.get('values') or {})
+    points = parameter_grid(spec.get('grid') or {})
+
+    prompts = []
+    coordinates = {}
+    for entry in entries:
+        if entry['prompt'] not in coordinates:
+            coordinates[entry['prompt']] = []
+            prompts.append(entry['prompt'])
+        coordinates[entry['prompt']].append({k: entry[k] for k in ('category', 'template', 'bindings')})
+
+    jobs = [{
+        'prompt_index': index,
+        'prompt': prompt,
+        'params': params,
+        'coordinates': coordinates[prompt]
+    } for index, prompt in enumerate(prompts) for params in points]
+
+    if not jobs:
+        raise ValueError("Sweep expands to no jobs; check template placeholder values")
+    if len(jobs) > SWEEP_CONFIG['MAX_JOBS']:
+        raise ValueError(f"Sweep expands to {len(jobs)} jobs, more than the {SWEEP_CONFIG['MAX_JOBS']} allowed")
+
+    return {'prompts': prompts, 'jobs': jobs, 'skipped': skipped}
+
+def sweep_report(sweep):
+    """
+    Build the report of a sweep, linking each music file to its grid coordinates.
+
+    Args:
+        sweep (Sweep): Sweep to report on
+
+    Returns:
+        dict: Sweep metadata and one entry per generated file
+    """
+    return {
+        'id': sweep.id,
+        'name': sweep.name,
+        'model_size': sweep.model_size,
+        'spec': json.loads(sweep.spec) if sweep.spec else None,
+        'created_at': sweep.created_at.isoformat(),
+        'runs': [{
+            'music_id': run.music_id,
+            'filename': run.music_file.filename,
+            'prompt': run.music_file.prompt,
+            'coordinates': json.loads(run.coordinates),
+            'evaluations': len(run.music_file.evaluations),
+            'average_rating': run.music_file.get_average_rating()
+        } for run in sweep.runs]
+    }
+
+def list_sweeps():
+    """Summaries of all sweeps, newest first."""
+    return [{
+        'id': s.id,
+        'name': s.name,
+        'model_size': s.model_size,
+        'runs': len(s.runs),
+        'created_at': s.created_at.isoformat()
+    } for s in Sweep.query.order_by(Sweep.created_at.desc()).all()]